@@ -15,6 +15,7 @@ from auto_editor.utils.types import (
     Args,
     frame_rate,
     margin,
+    natural,
     number,
     parse_color,
     resolution,
@@ -211,6 +212,11 @@ def main_options(parser: ArgumentParser) -> ArgumentParser:
         flag=True,
         help="Disable file seeking when rendering video. Helpful for debugging desync issues",
     )
+    parser.add_argument(
+        "--smart-render",
+        flag=True,
+        help="Copy the GOPs of unchanged clips instead of re-encoding them. H.264 only",
+    )
     parser.add_text("Audio Rendering:")
     parser.add_argument(
         "--audio-codec",
@@ -257,6 +263,17 @@ def main_options(parser: ArgumentParser) -> ArgumentParser:
     parser.add_argument(
         "--no-cache", flag=True, help="Don't look for or write a cache file"
     )
+    parser.add_argument(
+        "--analysis-jobs",
+        type=natural,
+        metavar="NUM",
+        help="Set how many processes long media is analyzed with",
+    )
+    parser.add_argument(
+        "--audio-envelope",
+        flag=True,
+        help="Derive audio levels from a cached 1ms envelope, for any timebase",
+    )
     parser.add_argument("--version", "-V", flag=True, help="Display version and halt")
     return parser
 
@@ -306,7 +323,16 @@ def download_video(my_input: str, args: Args, ffmpeg: FFmpeg, log: Log) -> str:
 
 
 def main() -> None:
-    subcommands = ("test", "info", "levels", "subdump", "desc", "repl", "palet")
+    subcommands = (
+        "test",
+        "info",
+        "levels",
+        "subdump",
+        "desc",
+        "repl",
+        "palet",
+        "cache",
+    )
 
     if len(sys.argv) > 1 and sys.argv[1] in subcommands:
         obj = __import__(
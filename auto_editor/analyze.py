@@ -2,30 +2,50 @@ from __future__ import annotations
 
 import os
 import re
-from dataclasses import dataclass
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
 from fractions import Fraction
-from math import ceil
-from tempfile import gettempdir
-from typing import TYPE_CHECKING
+from math import ceil, lcm, pi, tan
+from typing import TYPE_CHECKING, Any
 
 import av
 import numpy as np
-from av.audio.fifo import AudioFifo
 from av.subtitles.subtitle import AssSubtitle
 
-from auto_editor import __version__
+from auto_editor.cache import Cache, fingerprint, prefix_digest
+from auto_editor.lib.data_structs import Keyword, Sym
+from auto_editor.utils.func import run_lengths
+from auto_editor.wavfile import WavError
+from auto_editor.wavfile import read as read_wav
 
 if TYPE_CHECKING:
-    from collections.abc import Iterator, Sequence
+    from collections.abc import Callable, Iterable, Iterator, Sequence
     from fractions import Fraction
     from pathlib import Path
 
     from numpy.typing import NDArray
 
     from auto_editor.ffwrapper import FileInfo
+    from auto_editor.lang.palet import Parser
     from auto_editor.utils.bar import Bar
     from auto_editor.utils.log import Log
 
+    LevelProc = tuple[str, tuple[str, ...], dict[str, object], tuple[str, ...]]
+
+
+MIN_SEGMENT = 60  # Seconds, shorter segments aren't worth a process.
+ENVELOPE_TB = Fraction(1000)  # Audio is analyzed in 1ms windows.
+RESUME_MARGIN = 2  # Seconds at the end of a grown file's old levels to redo.
+
+# Columns of the `audio-features` array. Band values are the RMS of the audio
+# within each band, in Hz. Loudness is BS.1770's, but of each tick on its own,
+# without the 3 second short-term window, so it follows cuts as closely as the
+# other features do.
+FEATURES = ("peak", "rms", "loudness", "low", "speech", "high")
+BANDS = ((0.0, 300.0), (300.0, 3400.0), (3400.0, float("inf")))
+SILENT_LUFS = -70.0  # Loudness of a silent tick, the absolute gate of BS.1770.
+
 
 class LevelError(Exception):
     pass
@@ -34,129 +54,930 @@ class LevelError(Exception):
 def mut_remove_small(
     arr: NDArray[np.bool_], lim: int, replace: int, with_: int
 ) -> None:
-    start_p = 0
-    active = False
-    for j, item in enumerate(arr):
-        if item == replace:
-            if not active:
-                start_p = j
-                active = True
-
-            if j == len(arr) - 1 and j - start_p < lim:
-                arr[start_p:] = with_
-        elif active:
-            if j - start_p < lim:
-                arr[start_p:j] = with_
-            active = False
+    starts, lengths = run_lengths(arr)
+    if len(starts) == 0:
+        return
+
+    small = (arr[starts] == replace) & (lengths < lim)
+    # The last run is also removed when it is exactly `lim` long.
+    small[-1] |= arr[starts[-1]] == replace and lengths[-1] == lim
+    arr[np.repeat(small, lengths)] = with_
 
 
 def mut_remove_large(
     arr: NDArray[np.bool_], lim: int, replace: int, with_: int
 ) -> None:
-    start_p = 0
-    active = False
-    for j, item in enumerate(arr):
-        if item == replace:
-            if not active:
-                start_p = j
-                active = True
-
-            if j == len(arr) - 1 and j - start_p >= lim:
-                arr[start_p:] = with_
-        elif active:
-            if j - start_p > lim:
-                arr[start_p:j] = with_
-            active = False
-
-
-def iter_audio(src, tb: Fraction, stream: int = 0) -> Iterator[np.float32]:
-    fifo = AudioFifo()
-    try:
-        container = av.open(src.path, "r")
-        audio_stream = container.streams.audio[stream]
-        sample_rate = audio_stream.rate
-
-        exact_size = (1 / tb) * sample_rate
-        accumulated_error = 0
+    starts, lengths = run_lengths(arr)
+    large = (arr[starts] == replace) & (lengths > lim)
+    arr[np.repeat(large, lengths)] = with_
+
+
+def tick_sizes(exact_size: Fraction) -> NDArray[np.int64]:
+    """
+    Return one period of tick sizes, in samples, for a tick that is `exact_size`
+    samples long. The accumulated rounding error is back to zero every
+    `exact_size.denominator` ticks, so the pattern can be tiled forever.
+    """
+    sizes = np.empty(exact_size.denominator, dtype=np.int64)
+    accumulated_error = Fraction(0)
+    for i in range(len(sizes)):
+        size_with_error = exact_size + accumulated_error
+        current_size = round(size_with_error)
+        accumulated_error = size_with_error - current_size
+        sizes[i] = current_size
+
+    return sizes
+
+
+def tick_offset(pattern: NDArray[np.int64], tick: int) -> int:
+    """Return the sample where `tick` starts, given a period from `tick_sizes`."""
+    q, r = divmod(tick, len(pattern))
+    return q * int(pattern.sum()) + int(pattern[:r].sum())
+
+
+def audio_ticks(samples: int, sample_rate: int, tb: Fraction) -> int:
+    """Return how many ticks `AudioPeaks` makes from `samples` samples."""
+    exact_size = Fraction(sample_rate) / tb
+    pattern = tick_sizes(exact_size)
+    last_start = samples - ceil(exact_size)
+    if last_start < 0:
+        return 0
+
+    count = int(last_start / exact_size) + 1
+    while count > 0 and tick_offset(pattern, count - 1) > last_start:
+        count -= 1
+    while tick_offset(pattern, count) <= last_start:
+        count += 1
+    return count
+
+
+def packets_duration(container: av.container.InputContainer, stream) -> Fraction | None:
+    """Find a stream's duration from packet timestamps, without decoding."""
+    start = end = None
+    for packet in container.demux(stream):
+        if packet.pts is None:
+            continue
+        packet_end = packet.pts + (packet.duration or 0)
+        start = packet.pts if start is None else min(start, packet.pts)
+        end = packet_end if end is None else max(end, packet_end)
+
+    if start is None or end is None or stream.time_base is None:
+        return None
+    return (end - start) * stream.time_base
+
+
+class AudioPeaks:
+    """Reduce blocks of decoded samples to one peak value per tick."""
+
+    __slots__ = ("pattern", "min_block", "ticks", "pending")
+
+    def __init__(self, sample_rate: int, tb: Fraction) -> None:
+        exact_size = Fraction(sample_rate) / tb
+        if exact_size < 1:
+            raise LevelError(f"audio: timebase {tb} is above the sample rate")
+
+        self.pattern = tick_sizes(exact_size)
+        self.min_block = ceil(exact_size)
+        self.ticks = 0
+        self.pending = np.zeros(0, dtype=np.float32)
+
+    def bounds(self, buffered: int) -> tuple[NDArray[np.int64], int]:
+        """
+        Return the start of every tick that can be read from `buffered` samples,
+        and the sample where the last of them ends.
+        """
+        usable = buffered - self.min_block
+        if usable < 0:
+            return np.zeros(0, dtype=np.int64), 0
+
+        period = len(self.pattern)
+        count = usable // int(self.pattern.min()) + 1
+        sizes = self.pattern[np.arange(self.ticks, self.ticks + count) % period]
+        ends = np.cumsum(sizes)
+        starts = ends - sizes
+
+        # A tick is only read when at least `min_block` samples are buffered.
+        n = int(np.searchsorted(starts, usable, side="right"))
+        self.ticks += n
+        return starts[:n], int(ends[n - 1])
+
+    def push(self, samples: NDArray[np.float32]) -> NDArray[np.float32]:
+        # `samples` is planar: (channels, samples)
+        np.abs(samples, out=samples)
+        peaks = np.concatenate((self.pending, samples.max(axis=0)))
+
+        starts, end = self.bounds(len(peaks))
+        self.pending = peaks[end:]
+        if len(starts) == 0:
+            return np.zeros(0, dtype=np.float32)
+        return np.maximum.reduceat(peaks[:end], starts)
+
+
+def k_weighting(freqs: NDArray[np.floating], sample_rate: int) -> NDArray[np.float64]:
+    """
+    Return the power response of the BS.1770 K-weighting filter at `freqs`: a
+    high shelf, then a high-pass. The biquads are made from their analog
+    prototypes, so they match the spec's coefficients at 48kHz and work at any
+    other rate.
+    """
+    z = np.exp(-2j * pi * freqs / sample_rate)
+
+    def response(b: tuple[float, ...], a: tuple[float, ...]) -> NDArray[np.float64]:
+        num = b[0] + b[1] * z + b[2] * z * z
+        den = a[0] + a[1] * z + a[2] * z * z
+        return np.abs(num / den) ** 2
+
+    k = tan(pi * 1681.974450955533 / sample_rate)
+    q = 0.7071752369554196
+    vh = 10 ** (3.999843853973347 / 20)
+    vb = vh**0.4996667741545416
+    shelf = response(
+        (vh + vb * k / q + k * k, 2 * (k * k - vh), vh - vb * k / q + k * k),
+        (1 + k / q + k * k, 2 * (k * k - 1), 1 - k / q + k * k),
+    )
+
+    k = tan(pi * 38.13547087602444 / sample_rate)
+    q = 0.5003270373238773
+    a0 = 1 + k / q + k * k
+    high_pass = response(
+        (1.0, -2.0, 1.0), (1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0)
+    )
+    return shelf * high_pass
+
+
+class AudioFeatures(AudioPeaks):
+    """
+    Reduce blocks of decoded samples to one row of `FEATURES` per tick. Every
+    spectral feature comes from one batched FFT of the block's ticks.
+    """
+
+    __slots__ = ("weights", "filters")
+
+    def __init__(self, sample_rate: int, tb: Fraction) -> None:
+        super().__init__(sample_rate, tb)
+
+        # Ticks are zero-padded to the longest tick size.
+        freqs = np.fft.rfftfreq(self.min_block, 1 / sample_rate)
+        # One-sided spectrum: every bin but DC and Nyquist stands for two.
+        self.weights = np.full(len(freqs), 2.0)
+        self.weights[0] = 1.0
+        if self.min_block % 2 == 0:
+            self.weights[-1] = 1.0
+        self.weights /= self.min_block
+
+        # A row for every band, then the K-weighting response.
+        masks = [(freqs >= lo) & (freqs < hi) for lo, hi in BANDS]
+        self.filters = np.vstack((*masks, k_weighting(freqs, sample_rate)))
+
+    def push(self, samples: NDArray[np.float32]) -> NDArray[np.float32]:
+        if self.pending.ndim == 1:
+            self.pending = np.zeros((samples.shape[0], 0), dtype=np.float32)
+        buf = np.concatenate((self.pending, samples), axis=1)
+
+        starts, end = self.bounds(buf.shape[1])
+        self.pending = buf[:, end:]
+        result = np.zeros((len(starts), len(FEATURES)), dtype=np.float32)
+        if len(starts) == 0:
+            return result
+
+        data = buf[:, :end]
+        sizes = np.diff(np.append(starts, end))
+        result[:, 0] = np.maximum.reduceat(np.abs(data).max(axis=0), starts)
+
+        # (channels, ticks, samples), samples past the end of a tick are zero.
+        # Each tick gets a Hann window, so a tone doesn't leak into far-off bands.
+        offsets = np.arange(self.min_block)
+        index = np.minimum(starts[:, np.newaxis] + offsets, end - 1)
+        inside = offsets < sizes[:, np.newaxis]
+        hann = np.sin(pi * (offsets + 0.5) / sizes[:, np.newaxis]) ** 2
+        window = np.where(inside, hann, 0.0)
+        frames = data[:, index] * window
+
+        # Parseval: the weighted power spectrum sums to the windowed tick's energy,
+        # dividing by the window's energy makes it the tick's mean square.
+        power = np.abs(np.fft.rfft(frames, axis=-1)) ** 2
+        power *= self.weights / (window**2).sum(axis=-1)[:, np.newaxis]
+        bands = power @ self.filters.T  # (channels, ticks, bands + 1)
+
+        result[:, 1] = np.sqrt(power.sum(axis=-1).mean(axis=0))
+        loudness = bands[..., -1].sum(axis=0)
+        with np.errstate(divide="ignore"):
+            result[:, 2] = np.maximum(-0.691 + 10 * np.log10(loudness), SILENT_LUFS)
+        result[:, 3:] = np.sqrt(bands[..., :-1].mean(axis=0))
+        return result
+
+
+def wav_peaks(path: Path, tb: Fraction) -> NDArray[np.float32] | None:
+    """
+    Get audio levels from a PCM or float WAV/RF64 file without decoding, by
+    reading its memory-mapped samples. Returns None for anything else.
+    """
+    with open(path, "rb") as fid:
+        if fid.read(4) not in (b"RIFF", b"RIFX", b"RF64"):
+            return None
+        fid.seek(0)
+        try:
+            sample_rate, data = read_wav(fid)
+        except WavError:
+            return None
+
+    # Scale like the resampler does when it converts to `fltp`.
+    if data.dtype.kind == "u":
+        offset, scale = 128.0, 1 / 128
+    elif data.dtype.kind == "i":
+        offset, scale = 0.0, 1 / 2 ** (data.dtype.itemsize * 8 - 1)
+    else:
+        offset, scale = 0.0, 1.0
+
+    peaks = AudioPeaks(sample_rate, tb)
+    blocks = []
+    for i in range(0, len(data), AudioAnalyzer.block_size):
+        block = data[i : i + AudioAnalyzer.block_size].astype(np.float32)
+        if offset:
+            block -= offset
+        np.abs(block, out=block)
+        samples = block.max(axis=1)
+        if scale != 1.0:
+            samples *= scale
+        blocks.append(peaks.push(samples[np.newaxis]))
+
+    return np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.float32)
+
+
+def pool_envelope(env: NDArray[np.float32], tb: Fraction) -> NDArray[np.float32]:
+    """
+    Derive audio levels for `tb` from an envelope of `ENVELOPE_TB` windows. A tick
+    gets the peak of every window it overlaps, so when a tick ends inside a window,
+    that window counts for both ticks.
+    """
+    step = ENVELOPE_TB / tb  # Windows per tick
+    count = len(env) * step.denominator // step.numerator
+    if count == 0:
+        return np.zeros(0, dtype=np.float32)
+
+    edges = np.arange(count + 1, dtype=np.int64) * step.numerator
+    straddles = edges[1:] % step.denominator != 0
+    edges //= step.denominator
+
+    result = np.maximum.reduceat(env[: edges[-1]], edges[:-1])
+    shared = edges[1:][straddles]
+    result[straddles] = np.maximum(result[straddles], env[shared])
+    return result
+
+
+class Analyzer(ABC):
+    """
+    Something that turns the decoded frames of one stream into a level array.
+
+    Subclasses set `kind` and `media` ("audio" or "video"), and `obj`, which is
+    used to build the cache key. `take` returns the level values that were
+    completed since the last call.
+
+    Analyzers that set `segmentable` can also work on a window of ticks,
+    `[start, end)`, after the bus seeks near `start`. They set `done` once the
+    window is full, which lets a segment be analyzed in its own process.
+    Windows always start on a multiple of `stride`.
+
+    An analyzer with a `fixed_tb` always works in that timebase, whatever the
+    timebase of the edit is. Its windows are converted to its own ticks.
+    """
+
+    kind: str
+    media: str
+    stream: int
+    obj: tuple
+    segmentable = False
+    fixed_tb: Fraction | None = None
+    stride = 1
+    start = 0
+    end: int | None = None
+    done = False
+
+    def setup(self, stream: av.stream.Stream) -> None:
+        pass
+
+    @abstractmethod
+    def push(self, frame: av.frame.Frame) -> None: ...
+
+    def flush(self) -> None:
+        pass
+
+    @abstractmethod
+    def take(self) -> NDArray: ...
+
+
+class AudioAnalyzer(Analyzer):
+    kind = "audio"
+    media = "audio"
+    segmentable = True
+    block_size = 1 << 17
+    reducer = AudioPeaks
+
+    def __init__(self, tb: Fraction, stream: int, rate: int = 0) -> None:
+        self.tb = tb
+        self.stream = stream
+        self.rate = rate
+        self.obj = (stream, rate)
+        self.frames: list[NDArray[np.float32]] = []
+        self.buffered = 0
+        self.produced = 0
+        self.ready: list[NDArray[np.float32]] = []
+
+    def setup(self, stream: av.stream.Stream) -> None:
+        assert isinstance(stream, av.AudioStream)
+
+        # With a `rate`, analyze a mono mixdown at that rate. Loudness doesn't
+        # need the full bandwidth.
+        layout: str | av.AudioLayout
+        if self.rate:
+            layout, rate = "mono", min(self.rate, stream.rate)
+        else:
+            layout, rate = stream.layout, stream.rate
+        self.resampled = rate != stream.rate
+        self.peaks = self.reducer(rate, self.tb)
+
+        # When starting mid-stream, find the first sample from timestamps.
+        self.skip: int | None = None
+        self.pos: int | None = None
+        if self.start > 0:
+            assert stream.time_base is not None
+            self.peaks.ticks = self.start
+            self.skip = tick_offset(self.peaks.pattern, self.start)
+            self.ratio = Fraction(rate, stream.rate)
+            self.samples_per_pts = stream.time_base * stream.rate
+            self.first_pts = stream.start_time or 0
 
         # Resample so that audio data is between [-1, 1]
-        resampler = av.AudioResampler(
-            av.AudioFormat("flt"), audio_stream.layout, sample_rate
-        )
+        self.resampler = av.AudioResampler(av.AudioFormat("fltp"), layout, rate)
+
+    def push(self, frame: av.frame.Frame) -> None:
+        assert isinstance(frame, av.AudioFrame)
+        if self.done:
+            return
+
+        if self.skip is not None and self.pos is None:
+            if frame.pts is None:
+                return
+            self.lead_in(frame)
+
+        # Skip time checks, other analyzers of the stream still get the pts.
+        pts, frame.pts = frame.pts, None
+        self.buffer(self.resampler.resample(frame))
+        frame.pts = pts
+
+        if self.buffered >= self.block_size:
+            self.process()
+
+    def lead_in(self, frame: av.AudioFrame) -> None:
+        """
+        Start the resampler on an input sample that a run from the beginning
+        makes an output sample at, by feeding it silence before `frame`. Then
+        every output sample matches the full run's once the silence is flushed
+        out of the resampler's filter, well before the first tick.
+        """
+        assert frame.pts is not None
+        first = round((frame.pts - self.first_pts) * self.samples_per_pts)
+        pad = first % self.ratio.denominator
+        self.pos = int((first - pad) * self.ratio)
+        if pad:
+            silence = av.AudioFrame(
+                format=frame.format.name, layout=frame.layout.name, samples=pad
+            )
+            for plane in silence.planes:
+                plane.update(bytes(plane.buffer_size))
+            silence.sample_rate = frame.sample_rate
+            self.buffer(self.resampler.resample(silence))
+
+    def buffer(self, reframes: list[av.AudioFrame]) -> None:
+        for reframe in reframes:
+            # `fltp` frames are already float32.
+            samples = reframe.to_ndarray().astype(np.float32, copy=False)
+            if self.pos is not None and self.skip is not None:
+                count = samples.shape[1]
+                samples = self.align(samples, self.pos)
+                self.pos += count
+            self.frames.append(samples)
+            self.buffered += samples.shape[1]
+
+    def align(self, samples: NDArray[np.float32], pos: int) -> NDArray[np.float32]:
+        """Trim or pad samples so that the first tick starts at sample zero."""
+        assert self.skip is not None
+        offset = self.skip - pos
+        if offset >= samples.shape[1]:
+            return samples[:, :0]
+
+        self.skip = None
+        if offset < 0:
+            pad = np.zeros((samples.shape[0], -offset), dtype=samples.dtype)
+            return np.concatenate((pad, samples), axis=1)
+        return samples[:, offset:]
+
+    def flush(self) -> None:
+        # Changing the rate delays some samples inside the resampler.
+        if self.resampled and not self.done:
+            self.buffer(self.resampler.resample(None))
+        self.process()
+
+    def process(self) -> None:
+        if self.frames:
+            result = self.peaks.push(np.concatenate(self.frames, axis=1))
+            self.frames = []
+            self.buffered = 0
+
+            if self.end is not None:
+                result = result[: self.end - self.start - self.produced]
+                self.done = self.produced + len(result) >= self.end - self.start
+            self.produced += len(result)
+            self.ready.append(result)
+
+    def take(self) -> NDArray[np.float32]:
+        if not self.ready:
+            return np.zeros(0, dtype=np.float32)
+        result = self.ready[0] if len(self.ready) == 1 else np.concatenate(self.ready)
+        self.ready = []
+        return result
 
-        for frame in container.decode(audio=stream):
-            frame.pts = None  # Skip time checks
 
-            for reframe in resampler.resample(frame):
-                fifo.write(reframe)
+class EnvelopeAnalyzer(AudioAnalyzer):
+    """
+    Audio peaks in `ENVELOPE_TB` windows. These are cached once per stream, and
+    levels for any timebase at or below it are pooled from them.
+    """
 
-            while fifo.samples >= ceil(exact_size):
-                size_with_error = exact_size + accumulated_error
-                current_size = round(size_with_error)
-                accumulated_error = size_with_error - current_size
+    kind = "audio-envelope"
+    fixed_tb = ENVELOPE_TB
 
-                audio_chunk = fifo.read(current_size)
-                assert audio_chunk is not None
-                arr = audio_chunk.to_ndarray().flatten()
-                yield np.max(np.abs(arr))
+    def __init__(self, tb: Fraction, stream: int, rate: int = 0) -> None:
+        super().__init__(ENVELOPE_TB, stream, rate)
 
-    finally:
-        container.close()
 
+class FeatureAnalyzer(AudioAnalyzer):
+    """Every audio feature in `FEATURES`, made in one pass and cached together."""
 
-def iter_motion(src, tb, stream: int, blur: int, width: int) -> Iterator[np.float32]:
-    container = av.open(src.path, "r")
+    kind = "audio-features"
+    reducer = AudioFeatures
 
-    video = container.streams.video[stream]
-    video.thread_type = "AUTO"
+    def take(self) -> NDArray[np.float32]:
+        return super().take().reshape(-1, len(FEATURES))
 
-    prev_frame = None
-    current_frame = None
-    total_pixels = None
-    index = 0
-    prev_index = -1
 
-    graph = av.filter.Graph()
-    graph.link_nodes(
-        graph.add_buffer(template=video),
-        graph.add("scale", f"{width}:-1"),
-        graph.add("format", "gray"),
-        graph.add("gblur", f"sigma={blur}"),
-        graph.add("buffersink"),
-    ).configure()
+class MotionAnalyzer(Analyzer):
+    kind = "motion"
+    media = "video"
+    segmentable = True
 
-    for unframe in container.decode(video):
-        if unframe.pts is None:
-            continue
+    def __init__(
+        self,
+        tb: Fraction,
+        stream: int,
+        width: int,
+        blur: int,
+        stride: int = 1,
+        roi: str = "",
+    ) -> None:
+        self.tb = tb
+        self.stream = stream
+        self.width = width
+        self.blur = blur
+        self.stride = stride
+        self.roi = roi
+        self.obj = (stream, width, blur, stride, roi)
+
+        # The last decoded frame, filtered only if it was needed for a value.
+        self.prev_frame: NDArray[np.uint8] | None = None
+        self.prev_unfiltered: tuple[int, Any] | None = None
+        self.total_pixels: int | None = None
+        self.mask: NDArray[np.bool_] | None = None
+        self.prev_index = -1
+        self.held = np.float32(0.0)
+        self.values: list[np.float32] = []
+        self.counts: list[int] = []
+
+        # Set `proxy` to a list to also keep the unblurred grayscale frames.
+        self.proxy: list[tuple[int, NDArray[np.uint8]]] | None = None
+        self.proxy_limit = 0
+
+    def setup(self, stream: av.stream.Stream) -> None:
+        # Blur in a second graph when collecting, the proxy is kept unblurred.
+        self.split = self.proxy is not None
+        self.blurrer: GrayFilter | None = None
+        self.graph = av.filter.Graph()
+        blur = [] if self.split else [self.graph.add("gblur", f"sigma={self.blur}")]
+        assert isinstance(stream, av.VideoStream)
+        try:
+            self.graph.link_nodes(
+                self.graph.add_buffer(template=stream),
+                # `roi` uses the crop filter's syntax: "w:h:x:y"
+                *([self.graph.add("crop", self.roi)] if self.roi else []),
+                self.graph.add("scale", f"{self.width}:-1"),
+                self.graph.add("format", "gray"),
+                *blur,
+                self.graph.add("buffersink"),
+            ).configure()
+        except av.FFmpegError as e:
+            raise LevelError(f"motion: invalid roi '{self.roi}'.") from e
+
+    def filter(self, unframe: Any, index: int) -> NDArray[np.uint8]:
+        self.graph.push(unframe)
+        frame = self.graph.vpull().to_ndarray().astype(np.uint8, copy=False)
+        if not self.split:
+            return frame
+
+        if self.proxy is not None:
+            self.proxy.append((index, frame))
+            if len(self.proxy) * frame.nbytes > self.proxy_limit:
+                self.proxy = None
+
+        if self.blurrer is None:
+            height, width = frame.shape
+            self.blurrer = GrayFilter(width, height, ("gblur", f"sigma={self.blur}"))
+        return self.blurrer(frame)
+
+    def push(self, unframe: av.frame.Frame) -> None:
+        if unframe.pts is None or self.done:
+            return
+
+        # The filters keep timestamps, so frames can be placed before filtering.
+        assert unframe.time is not None
+        self.step(round(unframe.time * self.tb), unframe)
+
+    def step(self, index: int, unframe: Any) -> None:
+        # The value fills every tick after the last frame's, up to this frame's,
+        # but only the ticks inside the window are kept.
+        first = self.prev_index + 1
+        if self.start > 0:
+            first = max(first, self.start)
+        last = index if self.end is None else min(index, self.end - 1)
+
+        # Only the first frame at or after each `stride` tick gets a new value, so
+        # only it and the frame before it go through the filter graph.
+        sample = first + (-first) % self.stride
+        if index > self.prev_index and sample <= last:
+            if self.prev_unfiltered is not None:
+                self.prev_frame = self.filter(*self.prev_unfiltered)
+
+            current_frame = self.filter(unframe, index)
+            if self.total_pixels is None:
+                self.total_pixels = current_frame.size
+
+            if self.prev_frame is None:
+                value = np.float32(0.0)
+            else:
+                # Compare in place, `to_ndarray` is already a view of the frame.
+                if self.mask is None or self.mask.shape != current_frame.shape:
+                    self.mask = np.empty(current_frame.shape, dtype=np.bool_)
+                np.not_equal(self.prev_frame, current_frame, out=self.mask)
+                value = np.float32(np.count_nonzero(self.mask) / self.total_pixels)
+
+            if sample > first:
+                self.values.append(self.held)
+                self.counts.append(sample - first)
+            self.values.append(value)
+            self.counts.append(last - sample + 1)
+
+            self.held = value
+            self.prev_frame = current_frame
+            self.prev_unfiltered = None
+        else:
+            if index > self.prev_index and last >= first:
+                self.values.append(self.held)
+                self.counts.append(last - first + 1)
 
-        graph.push(unframe)
-        frame = graph.vpull()
-        assert frame.time is not None
-        index = round(frame.time * tb)
+            self.prev_unfiltered = (unframe, index)
 
-        if total_pixels is None:
-            total_pixels = frame.width * frame.height
+        self.prev_index = index
+        self.done = self.end is not None and index >= self.end - 1
 
-        current_frame = frame.to_ndarray()
-        if prev_frame is None:
-            value = np.float32(0.0)
+    def take(self) -> NDArray[np.float32]:
+        result = np.repeat(np.array(self.values, dtype=np.float32), self.counts)
+        self.values = []
+        self.counts = []
+        return result
+
+
+class GrayFilter:
+    """Run grayscale frames, as uint8 arrays, through a filter graph."""
+
+    def __init__(self, width: int, height: int, *filters: tuple[str, str]) -> None:
+        self.time_base = Fraction(1, 1000)
+        self.pts = 0
+        self.graph = av.filter.Graph()
+        self.graph.link_nodes(
+            self.graph.add_buffer(
+                width=width,
+                height=height,
+                format=av.VideoFormat("gray"),
+                time_base=self.time_base,
+            ),
+            *(self.graph.add(name, args) for name, args in filters),
+            self.graph.add("buffersink"),
+        ).configure()
+
+    def __call__(self, arr: NDArray[np.uint8]) -> NDArray[np.uint8]:
+        frame = av.VideoFrame.from_ndarray(np.ascontiguousarray(arr), format="gray")
+        frame.pts = self.pts
+        frame.time_base = self.time_base
+        self.pts += 1
+
+        self.graph.push(frame)
+        return self.graph.vpull().to_ndarray().astype(np.uint8, copy=False)
+
+
+class ProxyMotion(MotionAnalyzer):
+    """
+    Motion levels computed from a proxy: the unblurred grayscale frames that a
+    stride 1 `MotionAnalyzer` filtered, and their tick indexes. Any blur and
+    stride can be replayed this way, since those are the only frames the
+    analyzer looks at. The width can't: scaling the proxy down doesn't give the
+    same frames as scaling the source.
+    """
+
+    def run(self, frames: NDArray[np.uint8], indexes: NDArray[np.int64]) -> NDArray:
+        height, width = frames.shape[1:]
+        self.gray = GrayFilter(width, height, ("gblur", f"sigma={self.blur}"))
+
+        for index, frame in zip(indexes.tolist(), frames):
+            self.step(index, frame)
+        return self.take()
+
+    def filter(self, unframe: Any, index: int) -> NDArray[np.uint8]:
+        return self.gray(unframe)
+
+
+# Analyzers that can run on the decode bus, by kind. Each factory is called with
+# the timebase and the kind's cache object.
+analyzers: dict[str, Callable[..., Analyzer]] = {
+    "audio": AudioAnalyzer,
+    "audio-envelope": EnvelopeAnalyzer,
+    "audio-features": FeatureAnalyzer,
+    "motion": MotionAnalyzer,
+}
+
+# Palet procs that read levels, so an `--edit` expression can be scanned before
+# it is evaluated. Each entry is: kind, positional parameters, defaults, and the
+# parameters that make up the kind's cache object.
+level_procs: dict[str, LevelProc] = {
+    "audio": (
+        "audio",
+        ("threshold", "stream", "mincut", "minclip", "rate"),
+        {"stream": Sym("all"), "rate": 0},
+        ("stream", "rate"),
+    ),
+    "audio-levels": ("audio", ("stream", "rate"), {"rate": 0}, ("stream", "rate")),
+    "feature": (
+        "audio-features",
+        ("feature", "threshold", "stream", "mincut", "minclip", "rate"),
+        {"stream": 0, "rate": 0},
+        ("stream", "rate"),
+    ),
+    "feature-levels": (
+        "audio-features",
+        ("feature", "stream", "rate"),
+        {"rate": 0},
+        ("stream", "rate"),
+    ),
+    "motion": (
+        "motion",
+        ("threshold", "stream", "blur", "width", "stride", "roi"),
+        {"stream": 0, "blur": 9, "width": 400, "stride": 1, "roi": ""},
+        ("stream", "width", "blur", "stride", "roi"),
+    ),
+    "motion-levels": (
+        "motion",
+        ("stream", "blur", "width", "stride", "roi"),
+        {"blur": 9, "width": 400, "stride": 1, "roi": ""},
+        ("stream", "width", "blur", "stride", "roi"),
+    ),
+}
+
+
+def register_analyzer(
+    kind: str,
+    factory: Callable[..., Analyzer],
+    proc: str | None = None,
+    params: Sequence[str] = (),
+    defaults: dict[str, object] | None = None,
+) -> None:
+    """
+    Add an analyzer to the decode bus. When `proc` is given, calls to that palet
+    proc in `--edit` are analyzed in the same demux as the built-in methods.
+    """
+    analyzers[kind] = factory
+    if proc is not None:
+        level_procs[proc] = (kind, tuple(params), defaults or {}, tuple(params))
+
+
+def needed_levels(parser: Parser, src: FileInfo) -> list[tuple[str, tuple]]:
+    """
+    Find every level array an expression will ask for. Calls whose arguments
+    aren't literals, or don't meet the proc's contracts, are skipped. They get
+    analyzed, or fail, on their own when evaluated.
+    """
+    from auto_editor.lang.palet import EOF, env
+    from auto_editor.lib.contracts import Proc, check_contract
+
+    def is_literal(val: object) -> bool:
+        return type(val) in (int, float, str, bool) or val == Sym("all")
+
+    def conforms(name: str, params: tuple[str, ...], given: dict, count: int) -> bool:
+        proc = env.get(name)
+        if not isinstance(proc, Proc) or not proc.contracts:
+            return True
+        if proc.arity[1] is not None and count > proc.arity[1]:
+            return False
+
+        for param, val in given.items():
+            if param in params and is_literal(val):
+                i = min(params.index(param), len(proc.contracts) - 1)
+                if not check_contract(proc.contracts[i], val):
+                    return False
+        return True
+
+    def visit(node: object, wanted: list[tuple[str, tuple]]) -> None:
+        if type(node) is Sym and node.val in level_procs:
+            node = (node,)
+
+        if type(node) is list:
+            for item in node:
+                visit(item, wanted)
+            return
+
+        if type(node) is not tuple or not node:
+            return
+
+        for item in node[1:]:
+            visit(item, wanted)
+
+        if type(node[0]) is not Sym or node[0].val not in level_procs:
+            return
+
+        kind, params, defaults, obj_params = level_procs[node[0].val]
+        given: dict[str, object] = {}
+        i, pos = 1, 0
+        while i < len(node):
+            if type(node[i]) is Keyword:
+                if i + 1 >= len(node):
+                    return
+                given[node[i].val] = node[i + 1]
+                i += 2
+            else:
+                given[params[pos] if pos < len(params) else f"#{pos}"] = node[i]
+                pos += 1
+                i += 1
+
+        values = defaults | given
+        if not all(p in values and is_literal(values[p]) for p in obj_params):
+            return
+        if not conforms(node[0].val, params, given, pos):
+            return
+
+        if kind == "audio" and values["stream"] == Sym("all"):
+            rate = values["rate"]
+            wanted.extend(("audio", (s, rate)) for s in range(len(src.audios)))
         else:
-            # Use `int16` to avoid underflow with `uint8` datatype
-            diff = np.abs(prev_frame.astype(np.int16) - current_frame.astype(np.int16))
-            value = np.float32(np.count_nonzero(diff) / total_pixels)
+            wanted.append((kind, tuple(values[p] for p in obj_params)))
 
-        for _ in range(index - prev_index):
-            yield value
+    wanted: list[tuple[str, tuple]] = []
+    while parser.current_token.type != EOF:
+        visit(parser.expr(), wanted)
+    return wanted
 
-        prev_frame = current_frame
-        prev_index = index
 
-    container.close()
+class DecodeBus:
+    """Demux a source once and hand every decoded frame to its analyzers."""
 
+    def __init__(
+        self,
+        src: FileInfo,
+        analyzers: Sequence[Analyzer],
+        seek: Fraction | None = None,
+    ) -> None:
+        self.src = src
+        self.analyzers = analyzers
+        self.seek = seek
+
+    def __iter__(self) -> Iterator[None]:
+        """
+        Step through the source, yields after each packet and after flushing.
+        Stops early once every analyzer is `done`.
+        """
+        container = av.open(self.src.path, "r")
+        try:
+            listeners: dict[int, list[Analyzer]] = {}
+            for analyzer in self.analyzers:
+                stream: av.AudioStream | av.VideoStream
+                if analyzer.media == "audio":
+                    stream = container.streams.audio[analyzer.stream]
+                else:
+                    stream = container.streams.video[analyzer.stream]
+                    stream.thread_type = "AUTO"
+
+                analyzer.setup(stream)
+                listeners.setdefault(stream.index, []).append(analyzer)
+
+            if self.seek is not None:
+                container.seek(int(self.seek * av.time_base), backward=True)
+
+            streams = [container.streams[i] for i in listeners]
+            for packet in container.demux(*streams):
+                for frame in packet.decode():
+                    # Only audio and video streams are demuxed.
+                    assert isinstance(frame, av.AudioFrame | av.VideoFrame)
+                    for analyzer in listeners[packet.stream.index]:
+                        analyzer.push(frame)
+                yield
+                if all(analyzer.done for analyzer in self.analyzers):
+                    break
 
-def obj_tag(path: Path, kind: str, tb: Fraction, obj: Sequence[object]) -> str:
-    mod_time = int(path.stat().st_mtime)
-    key = f"{path.name}:{mod_time:x}:{kind}:{tb}:"
+            for analyzer in self.analyzers:
+                analyzer.flush()
+            yield
+        finally:
+            container.close()
+
+    def run(self, bar: Bar, title: str, total: int) -> list[NDArray]:
+        parts: list[list[NDArray]] = [[] for _ in self.analyzers]
+        index = 0
+
+        bar.start(total, title)
+        for _ in self:
+            for part, analyzer in zip(parts, self.analyzers):
+                if len(arr := analyzer.take()):
+                    part.append(arr)
+                    if part is parts[0]:
+                        index += len(arr)
+                        bar.tick(index)
+        bar.end()
+
+        return [
+            np.concatenate(part) if part else np.zeros(0, dtype=np.float32)
+            for part in parts
+        ]
+
+
+def tick_scale(analyzer: Analyzer, tb: Fraction) -> Fraction:
+    """Return how many of the analyzer's ticks fit in one tick of `tb`."""
+    return Fraction(1) if analyzer.fixed_tb is None else analyzer.fixed_tb / tb
+
+
+def analyze_segment(
+    src: FileInfo,
+    tb: Fraction,
+    specs: Sequence[tuple[str, tuple]],
+    start: int,
+    end: int | None,
+) -> list[NDArray]:
+    """Analyze ticks `[start, end)` of a source. Runs in a worker process."""
+    todo = []
+    for kind, obj in specs:
+        analyzer = analyzers[kind](tb, *obj)
+        scale = tick_scale(analyzer, tb)
+        analyzer.start = int(start * scale)
+        analyzer.end = None if end is None else int(end * scale)
+        todo.append(analyzer)
+
+    # Seek a little early, analyzers drop what comes before `start`. Motion also
+    # needs the frame before `start` to diff against.
+    seek = max(Fraction(start) / tb - 1, Fraction(0)) if start > 0 else None
+    for _ in DecodeBus(src, todo, seek):
+        pass
+    return [analyzer.take() for analyzer in todo]
+
+
+def iter_audio_blocks(
+    src, tb: Fraction, streams: Sequence[int], rate: int = 0
+) -> Iterator[tuple[int, NDArray[np.float32]]]:
+    """Yield `(stream, block)` pairs of tick peaks for every requested stream."""
+    audio_analyzers = [AudioAnalyzer(tb, s, rate) for s in streams]
+    for _ in DecodeBus(src, audio_analyzers):
+        for analyzer in audio_analyzers:
+            if len(block := analyzer.take()):
+                yield analyzer.stream, block
+
+
+def iter_audio(
+    src, tb: Fraction, stream: int = 0, rate: int = 0
+) -> Iterator[np.float32]:
+    for _, block in iter_audio_blocks(src, tb, (stream,), rate):
+        yield from block
+
+
+def iter_motion(
+    src, tb, stream: int, blur: int, width: int, stride: int = 1, roi: str = ""
+) -> Iterator[np.float32]:
+    analyzer = MotionAnalyzer(tb, stream, width, blur, stride, roi)
+    for _ in DecodeBus(src, (analyzer,)):
+        yield from analyzer.take()
+
+
+def obj_tag(
+    path: Path, kind: str, tb: Fraction, obj: Sequence[object], key_mode: str = "path"
+) -> str:
+    if key_mode == "content":
+        key = f"{fingerprint(f'{path}')}:{kind}:{tb}:"
+    else:
+        mod_time = int(path.stat().st_mtime)
+        key = f"{path.name}:{mod_time:x}:{kind}:{tb}:"
     return key + ",".join(f"{v}" for v in obj)
 
 
@@ -168,31 +989,105 @@ class Levels:
     no_cache: bool
     log: Log
     strict: bool
+    memo: dict[str, np.ndarray] = field(default_factory=dict)
+    store: Cache | None = None
+    jobs: int = 1
+    envelope: bool = False
+    min_segment: float = MIN_SEGMENT
+
+    def disk_cache(self) -> Cache:
+        # Read the index once per source instead of on every lookup.
+        if self.store is None:
+            self.store = Cache()
+        return self.store
+
+    def kind_tb(self, kind: str) -> Fraction:
+        return getattr(analyzers.get(kind), "fixed_tb", None) or self.tb
+
+    def tag(self, kind: str, obj: Sequence[object]) -> str:
+        key_mode = "path" if self.no_cache else self.disk_cache().key_mode
+        return obj_tag(self.src.path, kind, self.kind_tb(kind), obj, key_mode)
+
+    def resume_tag(self, kind: str, obj: Sequence[object]) -> str:
+        # Unlike `tag`, this stays the same while a recording grows.
+        key = f"{self.src.path.resolve()}:resume:{kind}:{self.kind_tb(kind)}:"
+        return key + ",".join(f"{v}" for v in obj)
 
     @property
     def media_length(self) -> int:
         if self.src.audios:
-            if (arr := self.read_cache("audio", (0,))) is not None:
+            if (arr := self.read_cache("audio", (0, 0))) is not None:
+                return len(arr)
+            if (arr := self.audio_from_envelope((0, 0))) is not None:
                 return len(arr)
 
-            result = sum(1 for _ in iter_audio(self.src, self.tb, 0))
-            self.log.debug(f"Audio Length: {result}")
+        if (arr := self.read_cache("length", ())) is None:
+            arr = self.cache(np.array([self.probe_length()]), "length", ())
+        return int(arr[0])
+
+    def probe_length(self) -> int:
+        """
+        Get the length without decoding all of the media. With audio, only the
+        frames near the end are decoded, and counted from where their timestamps
+        place them, like a segment that starts mid-stream. Otherwise, use stream
+        metadata, then container metadata, then packet timestamps.
+        """
+        if self.src.audios:
+            samples = self.audio_samples(seek=True) or self.audio_samples(seek=False)
+            rate = self.src.audios[0].samplerate
+            result = audio_ticks(samples, rate, self.tb)
+            self.log.debug(f"Media length: {result}")
             return result
 
-        # If there's no audio, get length in video metadata.
-        with av.open(self.src.path) as container:
-            if len(container.streams.video) == 0:
+        with av.open(self.src.path, "r") as container:
+            if not container.streams.video:
                 self.log.error("Could not get media duration")
+            stream = container.streams.video[0]
 
-            video = container.streams.video[0]
-
-            if video.duration is None or video.time_base is None:
-                dur = 0
+            if stream.duration is not None and stream.time_base is not None:
+                dur: Fraction | None = stream.duration * stream.time_base
+            elif container.duration is not None:
+                dur = Fraction(container.duration, av.time_base)
             else:
-                dur = int(video.duration * video.time_base * self.tb)
-            self.log.debug(f"Video duration: {dur}")
+                dur = packets_duration(container, stream)
+
+        result = 0 if dur is None else int(dur * self.tb)
+        self.log.debug(f"Media length: {result}")
+        return result
 
-        return dur
+    def audio_samples(self, seek: bool) -> int:
+        """
+        Count the samples that decoding the first audio stream makes. With `seek`,
+        start a second before the end, and return 0 if that can't be done.
+        """
+        with av.open(self.src.path, "r") as container:
+            stream = container.streams.audio[0]
+            if not seek:
+                return sum(frame.samples for frame in container.decode(stream))
+
+            assert stream.time_base is not None
+            if stream.duration is not None:
+                dur: Fraction | None = stream.duration * stream.time_base
+            elif container.duration is not None:
+                dur = Fraction(container.duration, av.time_base)
+            else:
+                dur = packets_duration(container, stream)
+            if dur is None or dur < 2:
+                return 0
+            try:
+                container.seek(int((dur - 1) * av.time_base), backward=True)
+            except av.FFmpegError:
+                return 0
+
+            first = stream.start_time or 0
+            samples_per_pts = stream.time_base * stream.rate
+            samples = 0
+            for frame in container.decode(stream):
+                if frame.pts is None:
+                    return 0
+                end = round((frame.pts - first) * samples_per_pts) + frame.samples
+                samples = max(samples, end)
+        return samples
 
     def none(self) -> NDArray[np.bool_]:
         return np.ones(self.media_length, dtype=np.bool_)
@@ -201,102 +1096,334 @@ class Levels:
         return np.zeros(self.media_length, dtype=np.bool_)
 
     def read_cache(self, kind: str, obj: Sequence[object]) -> None | np.ndarray:
-        if self.no_cache:
-            return None
+        key = self.tag(kind, obj)
+        if key in self.memo:
+            return self.memo[key]
 
-        workfile = os.path.join(gettempdir(), f"ae-{__version__}", "cache.npz")
-
-        try:
-            npzfile = np.load(workfile, allow_pickle=False)
-        except Exception as e:
-            self.log.debug(e)
+        if self.no_cache:
             return None
 
-        key = obj_tag(self.src.path, kind, self.tb, obj)
-        if key not in npzfile.files:
+        if (arr := self.disk_cache().get(key)) is None:
             return None
 
         self.log.debug("Using cache")
-        return npzfile[key]
+        self.memo[key] = arr
+        return arr
 
     def cache(self, arr: np.ndarray, kind: str, obj: Sequence[object]) -> np.ndarray:
-        if self.no_cache:
-            return arr
+        key = self.tag(kind, obj)
+        self.memo[key] = arr
 
-        workdur = os.path.join(gettempdir(), f"ae-{__version__}")
-        if not os.path.exists(workdur):
-            os.mkdir(workdur)
-
-        key = obj_tag(self.src.path, kind, self.tb, obj)
-        np.savez(os.path.join(workdur, "cache.npz"), **{key: arr})
+        if not self.no_cache:
+            self.disk_cache().put(key, arr)
 
         return arr
 
-    def audio(self, stream: int) -> NDArray[np.float32]:
-        if stream >= len(self.src.audios):
-            raise LevelError(f"audio: audio stream '{stream}' does not exist.")
+    def prefetch(self, wanted: Iterable[tuple[str, tuple]]) -> None:
+        """
+        Like `fetch`, but only a head start: when analyzing fails, the error is
+        left for the call that needs the levels to report.
+        """
+        try:
+            self.fetch(wanted)
+        except (LevelError, ValueError, ZeroDivisionError, av.FFmpegError) as e:
+            self.log.debug(f"Prefetch failed: {e}")
+
+    def fetch(self, wanted: Iterable[tuple[str, tuple]]) -> None:
+        """Analyze every level array in `wanted` that isn't cached in one demux."""
+        todo: list[Analyzer] = []
+        pooled: list[tuple] = []
+        seen = set()
+        for kind, obj in wanted:
+            if (kind, obj) in seen or self.read_cache(kind, obj) is not None:
+                continue
+            seen.add((kind, obj))
+
+            if kind == "audio" and self.uses_envelope(obj):
+                pooled.append(obj)
+                kind = "audio-envelope"
+                if self.read_cache(kind, obj) is not None:
+                    continue
+
+            if kind == "motion" and (arr := self.motion_from_proxy(obj)) is not None:
+                self.cache(arr, kind, obj)
+                continue
+
+            analyzer = analyzers[kind](self.tb, *obj)
 
-        if (arr := self.read_cache("audio", (stream,))) is not None:
-            return arr
+            # PCM WAVs can skip the decoder and resampler entirely.
+            if type(analyzer) in (AudioAnalyzer, EnvelopeAnalyzer) and obj == (0, 0):
+                assert isinstance(analyzer, AudioAnalyzer)
+                if (arr := wav_peaks(self.src.path, analyzer.tb)) is not None:
+                    self.log.debug("Read WAV samples directly")
+                    self.cache(arr, kind, obj)
+                    continue
 
+            media = self.src.audios if analyzer.media == "audio" else self.src.videos
+            if analyzer.stream < len(media):
+                todo.append(analyzer)
+
+        if todo:
+            self.analyze(todo)
+        for obj in pooled:
+            self.audio_from_envelope(obj)
+
+    def analyze(self, todo: list[Analyzer]) -> None:
+        """Run analyzers over the source and cache what they make."""
+        first = todo[0]
         with av.open(self.src.path, "r") as container:
-            audio = container.streams.audio[stream]
-            if audio.duration is not None and audio.time_base is not None:
-                inaccurate_dur = int(audio.duration * audio.time_base * self.tb)
-            elif container.duration is not None:
+            if first.media == "audio":
+                stream: av.stream.Stream = container.streams.audio[first.stream]
+            else:
+                stream = container.streams.video[first.stream]
+
+            if stream.duration is not None and stream.time_base is not None:
+                inaccurate_dur = int(stream.duration * stream.time_base * self.tb)
+            elif first.media == "audio" and container.duration is not None:
                 inaccurate_dur = int(container.duration / av.time_base * self.tb)
             else:
                 inaccurate_dur = 1024
 
-        bar = self.bar
-        bar.start(inaccurate_dur, "Analyzing audio volume")
+        kinds = {a.kind for a in todo}
+        if kinds <= {"audio", "audio-envelope"}:
+            title = "Analyzing audio volume"
+        elif kinds == {"motion"}:
+            title = "Analyzing motion"
+        else:
+            title = "Analyzing media"
+
+        # Progress is counted in the first analyzer's ticks.
+        align = lcm(*(a.stride * tick_scale(a, self.tb).denominator for a in todo))
+        start, prefixes = self.resume(todo, align)
+        size = os.path.getsize(self.src.path)
+        total = int((inaccurate_dur - start) * tick_scale(first, self.tb))
+
+        bounds = [start + b for b in self.segments(inaccurate_dur - start, align)]
+        if len(bounds) > 1 and all(a.segmentable for a in todo):
+            results = self.run_segments(todo, bounds, title, total)
+        elif start > 0:
+            specs = [(a.kind, a.obj) for a in todo]
+            results = analyze_segment(self.src, self.tb, specs, start, None)
+        else:
+            self.collect_proxies(todo)
+            results = DecodeBus(self.src, todo).run(self.bar, title, total)
+            self.save_proxies(todo)
+
+        if prefixes:
+            results = [np.concatenate(pair) for pair in zip(prefixes, results)]
+        for analyzer, result in zip(todo, results):
+            self.cache(result, analyzer.kind, analyzer.obj)
+        self.save_resume(todo, size)
+
+    def resume(self, todo: list[Analyzer], align: int) -> tuple[int, list[NDArray]]:
+        """
+        Find where analysis can pick up when the file only grew since it was last
+        analyzed, like a recording that is still being written. Returns the tick
+        to start from and the levels each analyzer already has before it.
+        """
+        if self.no_cache or not all(a.segmentable for a in todo):
+            return 0, []
+
+        old = []
+        for analyzer in todo:
+            if (arr := self.read_resume(analyzer)) is None:
+                return 0, []
+            old.append(arr)
+
+        # The old end may have been cut mid-packet, so analyze it again.
+        scales = [tick_scale(a, self.tb) for a in todo]
+        end = min(int(len(arr) / scale) for arr, scale in zip(old, scales))
+        start = (end - ceil(RESUME_MARGIN * self.tb)) // align * align
+        if start <= 0:
+            return 0, []
+
+        self.log.debug(f"Resuming analysis at tick {start}")
+        return start, [arr[: int(start * s)] for arr, s in zip(old, scales)]
+
+    def read_resume(self, analyzer: Analyzer) -> np.ndarray | None:
+        store = self.disk_cache()
+        if (meta := store.get(self.resume_tag(analyzer.kind, analyzer.obj))) is None:
+            return None
 
-        result = np.zeros((inaccurate_dur), dtype=np.float32)
-        index = 0
-        for value in iter_audio(self.src, self.tb, stream):
-            if index > len(result) - 1:
-                result = np.concatenate(
-                    (result, np.zeros((len(result)), dtype=np.float32))
-                )
-            result[index] = value
-            bar.tick(index)
-            index += 1
+        try:
+            size, digest, key = meta.tobytes().decode().split(" ", 2)
+            path = f"{self.src.path}"
+            if os.path.getsize(path) < int(size):
+                return None
+            if prefix_digest(path, int(size)) != digest:
+                return None
+        except (OSError, UnicodeDecodeError, ValueError):
+            return None
+        return store.get(key)
 
-        bar.end()
-        return self.cache(result[:index], "audio", (stream,))
+    def save_resume(self, todo: list[Analyzer], size: int) -> None:
+        """
+        Remember which levels were made from the first `size` bytes of the file,
+        and a hash of those bytes to tell if a later, larger file only grew.
+        """
+        if self.no_cache:
+            return
+
+        digest = prefix_digest(f"{self.src.path}", size)
+        for analyzer in todo:
+            key = self.tag(analyzer.kind, analyzer.obj)
+            meta = f"{size} {digest} {key}".encode()
+            tag = self.resume_tag(analyzer.kind, analyzer.obj)
+            self.disk_cache().put(tag, np.frombuffer(meta, dtype=np.uint8))
+
+    def uses_envelope(self, obj: tuple) -> bool:
+        """
+        Whether audio levels for `obj` are pooled from an envelope. Pooled ticks
+        can take a peak from up to one window past their edges, so this is only
+        done when `envelope` is set.
+        """
+        stream, rate = obj
+        if not self.envelope or stream >= len(self.src.audios):
+            return False
+        sample_rate = self.src.audios[stream].samplerate
+        if rate:
+            sample_rate = min(rate, sample_rate)
+        return self.tb <= ENVELOPE_TB <= sample_rate
+
+    def audio_from_envelope(self, obj: tuple) -> NDArray[np.float32] | None:
+        if not self.uses_envelope(obj):
+            return None
+        if (env := self.read_cache("audio-envelope", obj)) is None:
+            return None
 
-    def motion(self, stream: int, blur: int, width: int) -> NDArray[np.float32]:
-        if stream >= len(self.src.videos):
-            raise LevelError(f"motion: video stream '{stream}' does not exist.")
+        # Pooling is cheap, so only the envelope is kept on disk.
+        arr = pool_envelope(env, self.tb)
+        self.memo[self.tag("audio", obj)] = arr
+        return arr
 
-        mobj = (stream, width, blur)
-        if (arr := self.read_cache("motion", mobj)) is not None:
-            return arr
+    def motion_proxy(
+        self, stream: int, width: int, roi: str
+    ) -> tuple[NDArray[np.uint8], NDArray[np.int64]] | None:
+        frames = self.read_cache("motion-proxy", (stream, width, roi))
+        indexes = self.read_cache("motion-proxy-index", (stream, width, roi))
+        if frames is None or indexes is None or len(frames) != len(indexes):
+            return None
+        return frames, indexes
 
-        with av.open(self.src.path, "r") as container:
-            video = container.streams.video[stream]
-            inaccurate_dur = (
-                1024
-                if video.duration is None or video.time_base is None
-                else int(video.duration * video.time_base * self.tb)
-            )
+    def motion_from_proxy(self, obj: tuple) -> NDArray[np.float32] | None:
+        stream, width, roi = obj[0], obj[1], obj[4]
+        proxy = self.motion_proxy(stream, width, roi)
+        if proxy is None or proxy[0].shape[2] != width:
+            return None
+
+        self.log.debug(f"Motion from proxy: {proxy[0].shape}")
+        return ProxyMotion(self.tb, *obj).run(*proxy)
+
+    def collect_proxies(self, todo: list[Analyzer]) -> None:
+        """Have a stride 1 motion analyzer per stream, width and roi keep a proxy."""
+        if self.no_cache:
+            return
 
-        bar = self.bar
-        bar.start(inaccurate_dur, "Analyzing motion")
+        limit = self.disk_cache().max_size // 4
+        keepers: dict[tuple[int, int, str], MotionAnalyzer] = {}
+        for a in todo:
+            if type(a) is MotionAnalyzer and a.stride == 1:
+                keepers.setdefault((a.stream, a.width, a.roi), a)
 
-        result = np.zeros((inaccurate_dur), dtype=np.float32)
+        for (stream, width, roi), analyzer in keepers.items():
+            if self.motion_proxy(stream, width, roi) is not None:
+                continue
+
+            # Don't bother when the proxy clearly won't fit.
+            video = self.src.videos[stream]
+            height = ceil(video.height * width / max(video.width, 1))
+            frames = video.duration * float(min(video.fps, 2 * self.tb))
+            if frames * width * height <= limit:
+                analyzer.proxy = []
+                analyzer.proxy_limit = limit
+
+    def save_proxies(self, todo: list[Analyzer]) -> None:
+        for a in todo:
+            if isinstance(a, MotionAnalyzer) and a.proxy:
+                frames = np.stack([frame for _, frame in a.proxy])
+                indexes = np.array([index for index, _ in a.proxy], dtype=np.int64)
+                obj = (a.stream, a.width, a.roi)
+                self.cache(frames, "motion-proxy", obj)
+                self.cache(indexes, "motion-proxy-index", obj)
+                a.proxy = None
+
+    def segments(self, total: int, align: int = 1) -> list[int]:
+        """
+        Split `total` ticks into segments of at least `min_segment` seconds each,
+        and return their start ticks. Starts are rounded down to a multiple of
+        `align`.
+        """
+        jobs = self.jobs if self.jobs > 0 else (os.cpu_count() or 1)
+        count = min(jobs, total // max(ceil(self.min_segment * self.tb), align, 1))
+        if count < 2:
+            return [0]
+        return sorted({total * i // count // align * align for i in range(count)})
+
+    def run_segments(
+        self, todo: list[Analyzer], bounds: list[int], title: str, total: int
+    ) -> list[NDArray]:
+        """Analyze each segment in its own process, then stitch them in order."""
+        specs = [(a.kind, a.obj) for a in todo]
+        ends: list[int | None] = [*bounds[1:], None]
         index = 0
-        for value in iter_motion(self.src, self.tb, stream, blur, width):
-            if index > len(result) - 1:
-                result = np.concatenate(
-                    (result, np.zeros((len(result)), dtype=np.float32))
-                )
-            result[index] = value
-            bar.tick(index)
-            index += 1
 
-        bar.end()
-        return self.cache(result[:index], "motion", mobj)
+        self.bar.start(total, title)
+        with ProcessPoolExecutor(len(bounds)) as executor:
+            futures = [
+                executor.submit(analyze_segment, self.src, self.tb, specs, start, end)
+                for start, end in zip(bounds, ends)
+            ]
+            for future in as_completed(futures):
+                index += len(future.result()[0])
+                self.bar.tick(index)
+        self.bar.end()
+
+        parts = [future.result() for future in futures]
+        return [np.concatenate([part[i] for part in parts]) for i in range(len(todo))]
+
+    def level(self, kind: str, obj: Sequence[object]) -> np.ndarray:
+        if kind not in analyzers:
+            raise LevelError(f"{kind}: no analyzer is registered for this kind.")
+
+        self.fetch(((kind, tuple(obj)),))
+        if (arr := self.read_cache(kind, obj)) is None:
+            raise LevelError(f"{kind}: stream '{obj[0]}' does not exist.")
+        return arr
+
+    def audio(self, stream: int, rate: int = 0) -> NDArray[np.float32]:
+        return self.audios((stream,), rate)[0]
+
+    def audios(
+        self, streams: Sequence[int], rate: int = 0
+    ) -> list[NDArray[np.float32]]:
+        for stream in streams:
+            if stream >= len(self.src.audios):
+                raise LevelError(f"audio: audio stream '{stream}' does not exist.")
+
+        self.fetch(("audio", (s, rate)) for s in streams)
+        return [self.level("audio", (s, rate)) for s in streams]
+
+    def features(self, stream: int, rate: int = 0) -> NDArray[np.float32]:
+        """Return a row of `FEATURES` for every tick."""
+        if stream >= len(self.src.audios):
+            raise LevelError(f"feature: audio stream '{stream}' does not exist.")
+
+        arr = self.level("audio-features", (stream, rate))
+        return arr.reshape(-1, len(FEATURES))
+
+    def feature(self, name: str, stream: int, rate: int = 0) -> NDArray[np.float32]:
+        if name not in FEATURES:
+            raise LevelError(f"feature: unknown feature '{name}'.")
+
+        return self.features(stream, rate)[:, FEATURES.index(name)]
+
+    def motion(
+        self, stream: int, blur: int, width: int, stride: int = 1, roi: str = ""
+    ) -> NDArray[np.float32]:
+        if stream >= len(self.src.videos):
+            raise LevelError(f"motion: video stream '{stream}' does not exist.")
+
+        return self.level("motion", (stream, width, blur, stride, roi))
 
     def subtitle(
         self,
@@ -314,6 +1441,40 @@ class Levels:
         except re.error as e:
             self.log.error(e)
 
+        rows, text = self.subtitle_index(stream)
+        length = int(rows[:, 2].max(initial=0))
+        result = np.zeros(length, dtype=np.bool_)
+
+        count = 0
+        group = -1
+        text_start = 0
+        for row_group, start, end, text_end in rows.tolist():
+            if row_group != group:
+                group = row_group
+                if max_count is not None and count >= max_count:
+                    break
+
+            line = text[text_start:text_end].decode(errors="ignore")
+            text_start = text_end
+            if line and re.search(re_pattern, line):
+                result[start:end] = 1
+                count += 1
+
+        return result
+
+    def subtitle_index(self, stream: int) -> tuple[NDArray[np.int64], bytes]:
+        """
+        Decode a subtitle stream once into rows of `(group, start, end, text_end)`
+        and the dialogue of every row joined together. Subs decoded from the same
+        packet share a group. Groups without dialogue still get an empty row, so
+        the stream's length is the largest end.
+        """
+        obj = (stream,)
+        rows = self.read_cache("subtitle-index", obj)
+        text = self.read_cache("subtitle-text", obj)
+        if rows is not None and text is not None:
+            return rows, text.tobytes()
+
         try:
             container = av.open(self.src.path, "r")
             subtitle_stream = container.streams.subtitles[stream]
@@ -321,8 +1482,9 @@ class Levels:
         except Exception as e:
             self.log.error(e)
 
-        # Get the length of the subtitle stream.
-        sub_length = 0
+        index: list[tuple[int, int, int, int]] = []
+        buf = bytearray()
+        group = 0
         for packet in container.demux(subtitle_stream):
             if packet.pts is None or packet.duration is None:
                 continue
@@ -332,40 +1494,18 @@ class Levels:
                 start = float(packet.pts * subtitle_stream.time_base)
                 dur = float(packet.duration * subtitle_stream.time_base)
 
-                end = round((start + dur) * self.tb)
-                sub_length = max(sub_length, end)
-
-        result = np.zeros((sub_length), dtype=np.bool_)
-        del sub_length
-
-        count = 0
-        early_exit = False
-        container.seek(0)
-        for packet in container.demux(subtitle_stream):
-            if packet.pts is None or packet.duration is None:
-                continue
-            if early_exit:
-                break
-            for subset in packet.decode():
-                if max_count is not None and count >= max_count:
-                    early_exit = True
-                    break
-
-                start = float(packet.pts * subtitle_stream.time_base)
-                dur = float(packet.duration * subtitle_stream.time_base)
-
                 san_start = round(start * self.tb)
                 san_end = round((start + dur) * self.tb)
 
-                for sub in subset:
-                    if not isinstance(sub, AssSubtitle):
-                        continue
-
-                    line = sub.dialogue.decode(errors="ignore")
-                    if line and re.search(re_pattern, line):
-                        result[san_start:san_end] = 1
-                        count += 1
+                lines = [sub.dialogue for sub in subset if isinstance(sub, AssSubtitle)]
+                for line in lines or [b""]:
+                    buf += line
+                    index.append((group, san_start, san_end, len(buf)))
+                group += 1
 
         container.close()
 
-        return result
+        rows = np.array(index, dtype=np.int64).reshape(-1, 4)
+        self.cache(rows, "subtitle-index", obj)
+        self.cache(np.frombuffer(bytes(buf), dtype=np.uint8), "subtitle-text", obj)
+        return rows, bytes(buf)
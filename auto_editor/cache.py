@@ -0,0 +1,303 @@
+from __future__ import annotations
+
+import os
+import sys
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import lru_cache
+from hashlib import sha1
+from tempfile import NamedTemporaryFile, gettempdir
+from time import sleep, time
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from auto_editor import __version__
+from auto_editor.lang.json import Lexer, Parser, dump
+from auto_editor.lib.err import MyError
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterator
+    from typing import IO
+
+DEFAULT_MAX_SIZE = 1 << 30  # 1 GiB
+TOUCH_INTERVAL = 60  # Seconds between index writes when an entry is reused.
+KEY_MODES = ("path", "content")
+SAMPLE_SIZE = 1 << 16
+SAMPLE_COUNT = 16
+STALE_AGE = 3600  # Stray files younger than this may belong to a running writer.
+
+
+def cache_dir() -> str:
+    return os.path.join(gettempdir(), f"ae-{__version__}")
+
+
+if sys.platform == "win32":
+    import msvcrt
+
+    def lock_file(file: IO) -> None:
+        while True:
+            try:
+                msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:  # LK_LOCK gives up after 10 seconds.
+                sleep(0.1)
+
+    def unlock_file(file: IO) -> None:
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+else:
+    import fcntl
+
+    # POSIX record locks, unlike flock, also work over NFS.
+    def lock_file(file: IO) -> None:
+        fcntl.lockf(file, fcntl.LOCK_EX)
+
+    def unlock_file(file: IO) -> None:
+        fcntl.lockf(file, fcntl.LOCK_UN)
+
+
+def atomic_write(path: str, mode: str, write: Callable[[IO], object]) -> None:
+    """Write to a temporary file next to `path`, then rename it into place."""
+    folder, name = os.path.split(path)
+    temp = NamedTemporaryFile(
+        mode, dir=folder, prefix=name, suffix=".tmp", delete=False
+    )
+    with temp as file:
+        try:
+            write(file)
+        except BaseException:
+            file.close()
+            os.remove(file.name)
+            raise
+
+    try:
+        os.replace(file.name, path)
+    except OSError:
+        os.remove(file.name)
+        raise
+
+
+def fingerprint(path: str) -> str:
+    """
+    Identify a file by its size and a hash of evenly spaced byte ranges,
+    so that copies and renamed files get the same key.
+    """
+    stat = os.stat(path)
+    return _fingerprint(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+@lru_cache(maxsize=64)
+def _fingerprint(path: str, size: int, _mtime: int) -> str:
+    digest = sha1(f"{size}:".encode())
+    with open(path, "rb") as file:
+        if size <= SAMPLE_SIZE * SAMPLE_COUNT:
+            digest.update(file.read())
+        else:
+            step = (size - SAMPLE_SIZE) // (SAMPLE_COUNT - 1)
+            for i in range(SAMPLE_COUNT):
+                file.seek(i * step)
+                digest.update(file.read(SAMPLE_SIZE))
+
+    return digest.hexdigest()
+
+
+def prefix_digest(path: str, size: int) -> str:
+    """
+    Hash the first `size` bytes of a file: all of them when they are few, else
+    evenly spaced ranges from the head to the range that ends at `size`.
+    """
+    digest = sha1(f"{size}:".encode())
+    with open(path, "rb") as file:
+        if size <= SAMPLE_SIZE * SAMPLE_COUNT:
+            digest.update(file.read(size))
+        else:
+            step = (size - SAMPLE_SIZE) / (SAMPLE_COUNT - 1)
+            for i in range(SAMPLE_COUNT):
+                file.seek(round(i * step))
+                digest.update(file.read(SAMPLE_SIZE))
+
+    return digest.hexdigest()
+
+
+@dataclass(slots=True)
+class CacheEntry:
+    key: str
+    file: str
+    size: int
+    used: float
+
+
+class Cache:
+    """
+    The analysis cache. Every entry is stored in its own `.npy` file and listed in
+    `index.json`. When the total size goes over `max_size`, the least recently
+    used entries are removed first.
+
+    Entries are memory-mapped read-only, so a hit only reads the array header.
+    `key_mode` decides whether media is identified by its name and mtime
+    ("path") or by a fingerprint of its contents ("content").
+
+    Files are only ever replaced by renaming a finished temporary file, so
+    readers never see a partial write. Anything that changes the index holds
+    the lock on `index.lock` and reloads the index first, so many processes
+    can share one cache directory.
+    """
+
+    __slots__ = ("root", "max_size", "key_mode", "entries")
+
+    def __init__(self, root: str | None = None) -> None:
+        self.root = cache_dir() if root is None else root
+        self.max_size = DEFAULT_MAX_SIZE
+        self.key_mode = "path"
+        self.entries: dict[str, CacheEntry] = {}
+        self.load()
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.root, "index.json")
+
+    @property
+    def total_size(self) -> int:
+        return sum(entry.size for entry in self.entries.values())
+
+    @property
+    def lock_path(self) -> str:
+        return os.path.join(self.root, "index.lock")
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        """Hold the index lock, with the latest index loaded."""
+        os.makedirs(self.root, exist_ok=True)
+        with open(self.lock_path, "a+b") as file:
+            lock_file(file)
+            try:
+                self.load()
+                yield
+            finally:
+                unlock_file(file)
+
+    def load(self) -> None:
+        try:
+            with open(self.index_path, encoding="utf-8") as file:
+                data = Parser(Lexer("index.json", file)).expr()
+
+            self.max_size = int(data.get("max-size", DEFAULT_MAX_SIZE))
+            if (key_mode := data.get("key-mode", "path")) in KEY_MODES:
+                self.key_mode = key_mode
+            self.entries = {
+                key: CacheEntry(key, e["file"], int(e["size"]), float(e["used"]))
+                for key, e in data["entries"].items()
+            }
+        except (OSError, MyError, AttributeError, KeyError, TypeError, ValueError):
+            self.entries = {}
+
+    def save(self) -> None:
+        """Write the index. Call this while holding `locked`."""
+        entries = {
+            key: {"file": e.file, "size": e.size, "used": e.used}
+            for key, e in self.entries.items()
+        }
+        data = {
+            "max-size": self.max_size,
+            "key-mode": self.key_mode,
+            "entries": entries,
+        }
+        atomic_write(self.index_path, "w", lambda file: dump(data, file))
+
+    def get(self, key: str) -> np.ndarray | None:
+        if (entry := self.entries.get(key)) is None:
+            return None
+
+        try:
+            arr = np.load(os.path.join(self.root, entry.file), mmap_mode="r")
+        except (OSError, ValueError):
+            with self.locked():
+                if key in self.entries:
+                    self.remove(key)
+                    self.save()
+            return None
+
+        # Don't rewrite the index on every hit, LRU only needs a rough order.
+        if (now := time()) - entry.used > TOUCH_INTERVAL:
+            entry.used = now
+            with self.locked():
+                if key in self.entries:
+                    self.entries[key].used = now
+                    self.save()
+        return arr
+
+    def put(self, key: str, arr: np.ndarray) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        file = f"{sha1(key.encode()).hexdigest()}.npy"
+        path = os.path.join(self.root, file)
+
+        try:
+            atomic_write(path, "wb", lambda f: np.save(f, arr))
+        except PermissionError:
+            return  # Another process has the old file mapped on Windows.
+
+        with self.locked():
+            try:
+                size = os.path.getsize(path)
+            except FileNotFoundError:
+                return  # Another process evicted it before we got the lock.
+            self.entries[key] = CacheEntry(key, file, size, time())
+            self.evict()
+            self.save()
+
+    def remove(self, key: str) -> None:
+        entry = self.entries.pop(key)
+        try:
+            os.remove(os.path.join(self.root, entry.file))
+        except FileNotFoundError:
+            pass
+        except PermissionError:
+            pass  # Still mapped on Windows, `prune` will get it later.
+
+    def evict(self) -> list[CacheEntry]:
+        """Remove least recently used entries until the cache fits in `max_size`."""
+        removed = []
+        total = self.total_size
+        for entry in sorted(self.entries.values(), key=lambda e: e.used):
+            if total <= self.max_size:
+                break
+            self.remove(entry.key)
+            total -= entry.size
+            removed.append(entry)
+
+        return removed
+
+    def prune(self) -> list[CacheEntry]:
+        """Drop entries whose files are gone, stale stray files, then evict."""
+        removed = []
+        with self.locked():
+            for entry in list(self.entries.values()):
+                if not os.path.isfile(os.path.join(self.root, entry.file)):
+                    del self.entries[entry.key]
+                    removed.append(entry)
+
+            known = {e.file for e in self.entries.values()}
+            for name in os.listdir(self.root):
+                # `.npz` files are left over from older versions, `.tmp` files
+                # from writers that crashed.
+                path = os.path.join(self.root, name)
+                if (
+                    name.endswith((".npy", ".npz", ".tmp"))
+                    and name not in known
+                    and time() - os.path.getmtime(path) > STALE_AGE
+                ):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+            removed.extend(self.evict())
+            self.save()
+        return removed
+
+    def clear(self) -> None:
+        with self.locked():
+            for key in list(self.entries):
+                self.remove(key)
+            self.save()
@@ -403,7 +403,10 @@ def edit_media(paths: list[str], ffmpeg: FFmpeg, args: Args, log: Log) -> None:
                 packet.stream = subtitle_stream
                 output.mux(packet)
 
-            if video_frame:
+            if isinstance(video_frame, list):
+                # Smart rendering gives packets that are ready to write.
+                output.mux(video_frame)
+            elif video_frame:
                 try:
                     output.mux(output_stream.encode(video_frame))
                 except av.error.ExternalError:
@@ -415,7 +418,7 @@ def edit_media(paths: list[str], ffmpeg: FFmpeg, args: Args, log: Log) -> None:
                     log.error(e)
 
         # Flush streams
-        if output_stream is not None:
+        if output_stream is not None and output_stream.codec_context.is_encoder:
             output.mux(output_stream.encode(None))
         for audio_stream in audio_streams:
             output.mux(audio_stream.encode(None))
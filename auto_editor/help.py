@@ -34,15 +34,22 @@ Editing Methods:
     - stream (or/c nat? 'all) : 'all
     - mincut nat? : 6
     - minclip nat? : 3
+    - rate nat? : 0
 
  ; mincut is more significant, there it has a larger default value.
  ; minclip gets applied first, then mincut
+ ; rate, when not 0, analyzes a mono mixdown resampled to that many Hz.
 
  - motion  ; Motion detection specialized for noisy real-life videos
     - threshold threshold? : 2%
     - stream nat? : 0
     - blur nat? : 9
     - width nat1? : 400
+    - stride nat1? : 1
+    - roi string? : ""
+
+ ; stride analyzes every Nth tick and holds its value until the next one.
+ ; roi only looks at part of the frame, using ffmpeg crop's "w:h:x:y" syntax.
 
  - subtitle  ; Detect when subtitle matches pattern as a RegEx string.
     - pattern string?
@@ -59,9 +66,12 @@ Command-line Examples:
   --edit audio:threshold=4%
   --edit audio:threshold=0.03
   --edit audio:stream=1
+  --edit audio:rate=8000
   --edit (or audio:4%,stream=0 audio:8%,stream=1) ; `threshold` is first
   --edit motion
   --edit motion:threshold=2%,blur=3
+  --edit motion:stride=4
+  --edit 'motion:roi="iw:ih-120:0:0"'
   --edit (or audio:4% motion:2%,blur=3)
   --edit none
   --edit all/e
@@ -222,6 +232,17 @@ Check out its docs for more info: https://ffmpeg.org/ffmpeg-filters.html#loudnor
 Examples:
 --audio-normalize #f
 --audio-normalize ebu:i=-5,lra=40,gain=5,tp=-1
+""".strip(),
+        "--analysis-jobs": """
+Split media into up to that many time segments, each at least a minute
+long, and decode and analyze every segment in its own process. The results
+are stitched back together. 0 uses every core. The default is 1
+""".strip(),
+        "--audio-envelope": """
+Analyze audio into peaks of 1ms windows and cache those instead. Audio levels
+for any timebase up to 1000 are then pooled from the same envelope, so changing
+the timebase doesn't decode the audio again. A tick takes the peak of every
+window it overlaps, so it may reach up to 1ms past its edges.
 """.strip(),
         "--silent-speed": "99999 is the 'cut speed' and values over that or <=0 are considered 'cut speeds' as well",
         "--video-speed": "99999 is the 'cut speed' and values over that or <=0 are considered 'cut speeds' as well",
@@ -232,5 +253,24 @@ Examples:
         "_": "Dump text-based subtitles to stdout with formatting stripped out"
     },
     "desc": {"_": "Display a media's description metadata"},
+    "cache": {
+        "_": """
+List, prune or clear the analysis cache.
+
+Usage:
+    auto-editor cache list
+    auto-editor cache prune --max-size 2GiB
+    auto-editor cache clear
+    auto-editor cache list --key-mode content
+""".strip(),
+        "--max-size": "Accepts B, KiB, MiB, GiB and TiB. The default is 1GiB",
+        "--key-mode": """
+`path` (the default) identifies media by its file name and modification time.
+
+`content` identifies media by its size and a hash of sampled byte ranges
+instead. Results then survive renames, copies and touches, which is useful
+when several machines share one cache directory through TMPDIR.
+""".strip(),
+    },
     "test": {"_": "Self-Hosted Unit and End-to-End tests"},
 }
@@ -13,7 +13,7 @@ from typing import TYPE_CHECKING
 
 import numpy as np
 
-from auto_editor.analyze import LevelError, mut_remove_small
+from auto_editor.analyze import FEATURES, LevelError, mut_remove_small
 from auto_editor.lib.contracts import *
 from auto_editor.lib.data_structs import *
 from auto_editor.lib.err import MyError
@@ -521,6 +521,9 @@ is_boolarr = Contract(
 )
 
 
+is_feature = Contract("feature?", lambda v: type(v) is str and v in FEATURES)
+
+
 def raise_(msg: str | Exception) -> NoReturn:
     raise MyError(msg)
 
@@ -539,22 +542,24 @@ def edit_all() -> np.ndarray:
     return env["@levels"].all()
 
 
-def audio_levels(stream: int) -> np.ndarray:
+def audio_levels(stream: int, rate: int = 0) -> np.ndarray:
     if "@levels" not in env:
         raise MyError("Can't use `audio` if there's no input media")
 
     try:
-        return env["@levels"].audio(stream)
+        return env["@levels"].audio(stream, rate)
     except LevelError as e:
         raise MyError(e)
 
 
-def motion_levels(stream: int, blur: int = 9, width: int = 400) -> np.ndarray:
+def motion_levels(
+    stream: int, blur: int = 9, width: int = 400, stride: int = 1, roi: str = ""
+) -> np.ndarray:
     if "@levels" not in env:
         raise MyError("Can't use `motion` if there's no input media")
 
     try:
-        return env["@levels"].motion(stream, blur, width)
+        return env["@levels"].motion(stream, blur, width, stride, roi)
     except LevelError as e:
         raise MyError(e)
 
@@ -564,6 +569,7 @@ def edit_audio(
     stream: object = Sym("all"),
     mincut: int = 6,
     minclip: int = 3,
+    rate: int = 0,
 ) -> np.ndarray:
     if "@levels" not in env:
         raise MyError("Can't use `audio` if there's no input media")
@@ -580,8 +586,8 @@ def edit_audio(
         stream_range = range(stream, stream + 1)
 
     try:
-        for s in stream_range:
-            audio_list = levels.audio(s) >= threshold
+        for levels_arr in levels.audios(stream_range, rate):
+            audio_list = levels_arr >= threshold
             if stream_data is None:
                 stream_data = audio_list
             else:
@@ -599,18 +605,66 @@ def edit_audio(
     return raise_(f"audio stream '{stream}' does not exist") if strict else levels.all()
 
 
+def feature_levels(feature: str, stream: int, rate: int = 0) -> np.ndarray:
+    if "@levels" not in env:
+        raise MyError("Can't use `feature` if there's no input media")
+
+    try:
+        return env["@levels"].feature(feature, stream, rate)
+    except LevelError as e:
+        raise MyError(e)
+
+
+# Default `feature` thresholds, loudness is in LUFS.
+feature_thresholds = {
+    "peak": 0.04,
+    "rms": 0.01,
+    "loudness": -40,
+    "low": 0.01,
+    "speech": 0.01,
+    "high": 0.01,
+}
+
+
+def edit_feature(
+    feature: str,
+    threshold: float | None = None,
+    stream: int = 0,
+    mincut: int = 6,
+    minclip: int = 3,
+    rate: int = 0,
+) -> np.ndarray:
+    if "@levels" not in env:
+        raise MyError("Can't use `feature` if there's no input media")
+
+    if threshold is None:
+        threshold = feature_thresholds[feature]
+
+    levels = env["@levels"]
+    try:
+        stream_data = levels.feature(feature, stream, rate) >= threshold
+    except LevelError as e:
+        return raise_(e) if levels.strict else levels.all()
+
+    mut_remove_small(stream_data, minclip, replace=1, with_=0)
+    mut_remove_small(stream_data, mincut, replace=0, with_=1)
+    return stream_data
+
+
 def edit_motion(
     threshold: float = 0.02,
     stream: int = 0,
     blur: int = 9,
     width: int = 400,
+    stride: int = 1,
+    roi: str = "",
 ) -> np.ndarray:
     if "@levels" not in env:
         raise MyError("Can't use `motion` if there's no input media")
 
     levels = env["@levels"]
     try:
-        return levels.motion(stream, blur, width) >= threshold
+        return levels.motion(stream, blur, width, stride, roi) >= threshold
     except LevelError as e:
         return raise_(e) if levels.strict else levels.all()
 
@@ -737,15 +791,25 @@ env = Env({})
 env.update({
     "none": Proc("none", edit_none, (0, 0)),
     "all/e": Proc("all/e", edit_all, (0, 0)),
-    "audio-levels": Proc("audio-levels", audio_levels, (1, 1), is_nat),
-    "audio": Proc("audio", edit_audio, (0, 4),
+    "audio-levels": Proc("audio-levels", audio_levels, (1, 2), is_nat, {"rate": 0}),
+    "audio": Proc("audio", edit_audio, (0, 5),
         is_threshold, orc(is_nat, Sym("all")), is_nat,
-        {"threshold": 0, "stream": 1, "minclip": 2, "mincut": 2}
+        {"threshold": 0, "stream": 1, "minclip": 2, "mincut": 2, "rate": 2}
+    ),
+    "feature-levels": Proc("feature-levels", feature_levels, (2, 3),
+        is_feature, is_nat, is_nat, {"rate": 2}
+    ),
+    "feature": Proc("feature", edit_feature, (1, 6),
+        is_feature, is_real, is_nat, is_nat, is_nat, is_nat,
+        {"threshold": 1, "stream": 2, "mincut": 3, "minclip": 4, "rate": 5}
+    ),
+    "motion-levels": Proc("motion-levels", motion_levels, (1, 5),
+        is_nat, is_nat, is_nat1, is_nat1, is_str,
+        {"blur": 1, "width": 2, "stride": 3, "roi": 4}
     ),
-    "motion-levels": Proc("motion-levels", motion_levels, (1, 3), is_nat, is_nat1, {"blur": 1, "width": 2}),
-    "motion": Proc("motion", edit_motion, (0, 4),
-        is_threshold, is_nat, is_nat1,
-        {"threshold": 0, "stream": 1, "blur": 1, "width": 2}
+    "motion": Proc("motion", edit_motion, (0, 6),
+        is_threshold, is_nat, is_nat, is_nat1, is_nat1, is_str,
+        {"threshold": 0, "stream": 1, "blur": 2, "width": 3, "stride": 4, "roi": 5}
     ),
     "subtitle": Proc("subtitle", edit_subtitle, (1, 4),
         is_str, is_nat, is_bool, orc(is_nat, is_void),
@@ -6,7 +6,7 @@ from typing import TYPE_CHECKING, NamedTuple
 
 import numpy as np
 
-from auto_editor.analyze import Levels
+from auto_editor.analyze import Levels, needed_levels
 from auto_editor.ffwrapper import FileInfo
 from auto_editor.lang.palet import Lexer, Parser, env, interpret, is_boolarr
 from auto_editor.lib.data_structs import print_str
@@ -145,7 +145,23 @@ def make_timeline(
 
             env["timebase"] = tb
             env["src"] = f"{src.path}"
-            env["@levels"] = Levels(src, tb, bar, args.no_cache, log, len(sources) < 2)
+            strict = len(sources) < 2
+            levels = Levels(
+                src,
+                tb,
+                bar,
+                args.no_cache,
+                log,
+                strict,
+                jobs=args.analysis_jobs,
+                envelope=args.audio_envelope,
+            )
+            env["@levels"] = levels
+
+            # Analyze everything the expression needs with one demux.
+            levels.prefetch(
+                needed_levels(Parser(Lexer("`--edit`", args.edit_based_on)), src)
+            )
 
             results = interpret(env, parser)
 
@@ -0,0 +1,327 @@
+"""
+Smart rendering: the GOPs of a clip that play unchanged are copied from the source
+as they are, and only the frames around them are encoded.
+"""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+from fractions import Fraction
+from itertools import islice
+from typing import TYPE_CHECKING
+
+import av
+
+from auto_editor.timeline import TlVideo
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+    from auto_editor.timeline import v3
+    from auto_editor.utils.log import Log
+    from auto_editor.utils.types import Args
+
+
+# Containers that store H.264 with length prefixed NAL units in an `avc3` sample
+# entry, which lets parameter sets change in-band.
+avc3_formats = {"mp4", "mov"}
+start_code = re.compile(rb"\x00?\x00\x00\x01")
+
+
+def parameter_sets(extradata: bytes) -> tuple[int, bytes]:
+    """
+    Read an avcC header. Return the size of NAL unit lengths and the SPS and PPS
+    NAL units it holds, length prefixed.
+    """
+    length_size = (extradata[4] & 3) + 1
+    units = []
+    pos = 5
+    for mask in (0x1F, 0xFF):
+        count = extradata[pos] & mask
+        pos += 1
+        for _ in range(count):
+            size = int.from_bytes(extradata[pos : pos + 2], "big")
+            units.append(extradata[pos + 2 : pos + 2 + size])
+            pos += 2 + size
+
+    return length_size, b"".join(
+        len(unit).to_bytes(length_size, "big") + unit for unit in units
+    )
+
+
+def length_prefixed(data: bytes, length_size: int) -> bytes:
+    """Turn an Annex B packet into one with length prefixed NAL units."""
+    return b"".join(
+        len(unit).to_bytes(length_size, "big") + unit
+        for unit in start_code.split(data)
+        if unit
+    )
+
+
+@dataclass(slots=True)
+class CopySpan:
+    """
+    Frames `[start, end)` made by whole GOPs: the packets from the keyframe at
+    `key_pts` and `key_dts`, up to the one at `stop_dts`.
+    """
+
+    start: int
+    end: int
+    key_pts: int
+    key_dts: int
+    stop_dts: int | None
+
+
+def scan_gops(
+    stream: av.VideoStream, cn: av.container.InputContainer, tb: Fraction
+) -> tuple[list[CopySpan], int]:
+    """
+    Find the closed GOPs of `stream` by demuxing it, in frames of `tb`, and the
+    largest distance between a packet's pts and dts.
+    """
+    assert stream.time_base is not None
+    packets = [
+        (packet.pts, packet.dts, packet.is_keyframe)
+        for packet in cn.demux(stream)
+        if packet.pts is not None and packet.dts is not None
+    ]
+    cn.seek(0)
+
+    delay = max((pts - dts for pts, dts, _ in packets), default=0)
+    keys = [i for i, (_, _, key) in enumerate(packets) if key]
+    gops = []
+    for i, j in zip(keys, keys[1:] + [len(packets)]):
+        key_pts, key_dts, _ = packets[i]
+        # Frames before the keyframe depend on the GOP before.
+        if any(pts < key_pts for pts, _, _ in packets[i:j]):
+            continue
+
+        indexes = [round(pts * stream.time_base * tb) for pts, _, _ in packets[i:j]]
+        stop_dts = packets[j][1] if j < len(packets) else None
+        gops.append(CopySpan(indexes[0], max(indexes) + 1, key_pts, key_dts, stop_dts))
+
+    return gops, delay
+
+
+def copy_spans(tl: v3, gops: list[CopySpan]) -> dict[int, CopySpan]:
+    """
+    Find the runs of GOPs that speed 1 clips play whole, as spans of timeline
+    ticks keyed by their start.
+    """
+    spans: dict[int, CopySpan] = {}
+    for clip in tl.v[0]:
+        if not isinstance(clip, TlVideo) or clip.speed != 1:
+            continue
+
+        span = None
+        for gop in gops:
+            if gop.start < clip.offset or gop.end > clip.offset + clip.dur:
+                continue
+
+            start = clip.start + gop.start - clip.offset
+            end = clip.start + gop.end - clip.offset
+            if span is not None and span.end == start and span.stop_dts == gop.key_dts:
+                span.end, span.stop_dts = end, gop.stop_dts
+            else:
+                span = CopySpan(start, end, gop.key_pts, gop.key_dts, gop.stop_dts)
+                spans[start] = span
+
+    return spans
+
+
+@dataclass(slots=True)
+class SmartRender:
+    """
+    Write packets copied from the source for the ticks in `spans` and encode the
+    rest, starting a new encoder after every copied span so each encoded run
+    begins on its own keyframe.
+    """
+
+    stream: av.VideoStream
+    model: av.VideoCodecContext
+    cn: av.container.InputContainer
+    spans: dict[int, CopySpan]
+    delay: int
+    length_size: int
+    headers: bytes
+    time_base: Fraction
+    tick: Fraction
+    encoder: av.VideoCodecContext | None = None
+    copying: Iterator[av.Packet] | None = None
+    copy_end: int = 0
+    last_dts: int | None = None
+    copied: int = 0
+    encoded: int = 0
+    packets: list[av.Packet] = field(default_factory=list)
+
+    def mux(self, packet: av.Packet) -> None:
+        # Keep dts increasing where runs meet.
+        if self.last_dts is not None and packet.dts <= self.last_dts:
+            packet.dts = self.last_dts + 1
+        self.last_dts = packet.dts
+        packet.time_base = self.time_base
+        packet.stream = self.stream
+        self.packets.append(packet)
+
+    def take(self) -> list[av.Packet]:
+        packets, self.packets = self.packets, []
+        return packets
+
+    def new_encoder(self) -> av.VideoCodecContext:
+        encoder = av.CodecContext.create(self.model.name, "w")
+        assert isinstance(encoder, av.VideoCodecContext)
+        for name in (
+            "width",
+            "height",
+            "pix_fmt",
+            "time_base",
+            "framerate",
+            "bit_rate",
+            "color_range",
+            "colorspace",
+            "color_primaries",
+            "color_trc",
+            "sample_aspect_ratio",
+        ):
+            if (value := getattr(self.model, name)) is not None:
+                setattr(encoder, name, value)
+
+        # Without B-frames, encoded packets can share the source's dts offset.
+        encoder.max_b_frames = 0
+        return encoder
+
+    def write_encoded(self, packets: list[av.Packet]) -> None:
+        for encoded in packets:
+            assert encoded.pts is not None
+            packet = av.Packet(length_prefixed(bytes(encoded), self.length_size))
+            packet.pts = round(encoded.pts * self.tick)
+            packet.dts = packet.pts - self.delay
+            packet.duration = round(self.tick)
+            packet.is_keyframe = encoded.is_keyframe
+            self.mux(packet)
+            self.encoded += 1
+
+    def end_encoder(self) -> None:
+        if self.encoder is not None:
+            self.write_encoded(self.encoder.encode(None))
+            self.encoder = None
+
+    def flush(self) -> list[av.Packet]:
+        self.end_encoder()
+        self.cn.close()
+        return self.take()
+
+    def encode(self, frame: av.VideoFrame) -> list[av.Packet]:
+        if self.encoder is None:
+            self.encoder = self.new_encoder()
+        self.write_encoded(self.encoder.encode(frame))
+        return self.take()
+
+    def span_packets(self, span: CopySpan) -> Iterator[av.Packet]:
+        stream = self.cn.streams.video[0]
+        shift = round(span.start * self.tick) - span.key_pts
+        self.cn.seek(span.key_pts, stream=stream)
+
+        # The encoder's headers may have replaced the source's, so repeat them.
+        headers = self.headers
+        for source in self.cn.demux(stream):
+            if source.dts is None or source.pts is None or source.dts < span.key_dts:
+                continue
+            if span.stop_dts is not None and source.dts >= span.stop_dts:
+                break
+
+            packet = av.Packet(headers + bytes(source))
+            headers = b""
+            packet.pts = source.pts + shift
+            packet.dts = source.dts + shift
+            packet.duration = source.duration
+            packet.is_keyframe = source.is_keyframe
+            self.copied += 1
+            yield packet
+
+    def copy(self, index: int) -> list[av.Packet] | None:
+        """
+        Return the packets to write for tick `index` if it is in a copied span,
+        one packet for every tick, or None if the tick should be encoded.
+        """
+        if self.copying is None:
+            if (span := self.spans.get(index)) is None:
+                return None
+            self.end_encoder()
+            self.copying = self.span_packets(span)
+            self.copy_end = span.end
+
+        count = 1 if index + 1 < self.copy_end else None
+        for packet in islice(self.copying, count):
+            self.mux(packet)
+        if count is None:
+            self.copying = None
+
+        return self.take()
+
+
+def make_smart_render(
+    output: av.container.OutputContainer,
+    tl: v3,
+    args: Args,
+    pix_fmt: str,
+    log: Log,
+) -> SmartRender | None:
+    """
+    Set up smart rendering, or return None and say why it can't be used for this
+    timeline.
+    """
+    sources = {obj.src for layer in tl.v for obj in layer if isinstance(obj, TlVideo)}
+
+    reason = None
+    cn = None
+    if len(tl.v) != 1 or not all(isinstance(obj, TlVideo) for obj in tl.v[0]):
+        reason = "the timeline has overlays"
+    elif len(sources) != 1:
+        reason = "the timeline uses more than one source"
+    elif not avc3_formats.intersection(output.format.name.split(",")):
+        reason = f"'{output.format.name}' output is not supported"
+    else:
+        cn = av.open(f"{sources.pop().path}")
+        stream = cn.streams.video[0]
+        extradata = stream.codec_context.extradata
+        if stream.codec_context.name != "h264" or args.video_codec != "h264":
+            reason = "only h264 to h264 is supported"
+        elif not extradata or extradata[0] != 1:
+            reason = "the source has no avcC header"
+        elif (
+            args.scale != 1
+            or (stream.width, stream.height) != tl.res
+            or stream.pix_fmt != pix_fmt
+            or stream.average_rate != tl.tb
+        ):
+            reason = "the output's size, pixel format, or frame rate differs"
+
+    if reason is not None:
+        if cn is not None:
+            cn.close()
+        log.warning(f"Can't smart render, {reason}. Encoding everything instead")
+        return None
+
+    assert cn is not None and stream.time_base is not None and extradata is not None
+    gops, delay = scan_gops(stream, cn, tl.tb)
+    spans = copy_spans(tl, gops)
+    log.debug(f"Smart render spans: {[(s.start, s.end) for s in spans.values()]}")
+
+    length_size, headers = parameter_sets(extradata)
+    # Encoded runs carry the encoder's SPS and PPS and copied runs the source's,
+    # so they can't all be in the avcC header as `avc1` requires.
+    output_stream = output.add_stream(template=stream)
+    assert isinstance(output_stream, av.VideoStream)
+    output_stream.codec_context.codec_tag = "avc3"
+    model = av.CodecContext.create(args.video_codec, "w")
+    assert isinstance(model, av.VideoCodecContext)
+    model.time_base = 1 / tl.tb
+    model.framerate = tl.tb
+
+    time_base = stream.time_base
+    tick = 1 / (tl.tb * time_base)
+    return SmartRender(
+        output_stream, model, cn, spans, delay, length_size, headers, time_base, tick
+    )
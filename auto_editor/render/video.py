@@ -1,18 +1,24 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from fractions import Fraction
 from typing import TYPE_CHECKING
 
 import av
 import numpy as np
+from av.video.frame import PictureType
 
 from auto_editor.output import parse_bitrate
-from auto_editor.timeline import TlImage, TlRect, TlVideo
+from auto_editor.render.smart import make_smart_render
+from auto_editor.timeline import ClipIndex, TlImage, TlRect, TlVideo
 
 if TYPE_CHECKING:
     from collections.abc import Iterator
     from typing import Any
 
+    from av.video.plane import VideoPlane
+    from numpy.typing import NDArray
+
     from auto_editor.ffwrapper import FileInfo
     from auto_editor.timeline import v3
     from auto_editor.utils.bar import Bar
@@ -52,6 +58,37 @@ allowed_pix_fmt = {
 }
 
 
+@dataclass(slots=True)
+class FilterCache:
+    """
+    Run frames through filter graphs that are configured once and kept, one for
+    every input geometry, pixel format and filter chain.
+    """
+
+    graphs: dict[tuple, av.filter.Graph] = field(default_factory=dict)
+
+    def __call__(
+        self, frame: av.VideoFrame, *filters: tuple[str, str]
+    ) -> av.VideoFrame:
+        key = (frame.width, frame.height, frame.format.name, filters)
+        if (graph := self.graphs.get(key)) is None:
+            graph = av.filter.Graph()
+            graph.link_nodes(
+                graph.add_buffer(
+                    width=frame.width,
+                    height=frame.height,
+                    format=frame.format,
+                    time_base=Fraction(1, 1000),
+                ),
+                *(graph.add(name, args) for name, args in filters),
+                graph.add("buffersink"),
+            ).configure()
+            self.graphs[key] = graph
+
+        graph.vpush(frame)
+        return graph.vpull()
+
+
 def make_solid(width: int, height: int, pix_fmt: str, bg: str) -> av.VideoFrame:
     hex_color = bg.lstrip("#").upper()
     rgb_color = tuple(int(hex_color[i : i + 2], 16) for i in (0, 2, 4))
@@ -61,11 +98,166 @@ def make_solid(width: int, height: int, pix_fmt: str, bg: str) -> av.VideoFrame:
     return rgb_frame.reformat(format=pix_fmt)
 
 
-def make_image_cache(tl: v3) -> dict[tuple[FileInfo, int], np.ndarray]:
+# 8-bit planar formats that images can be blended into directly.
+planar_yuv = {"yuv420p", "yuvj420p", "yuv422p", "yuvj422p", "yuv444p", "yuvj444p"}
+
+
+def plane_array(plane: VideoPlane) -> NDArray[np.uint8]:
+    """View a plane of an 8-bit planar frame as a writable 2D array."""
+    arr = np.frombuffer(memoryview(plane), dtype=np.uint8)
+    return arr.reshape(plane.height, plane.line_size)[:, : plane.width]
+
+
+def block_mean(arr: NDArray[np.uint16], height: int, width: int) -> NDArray[np.uint16]:
+    """Downsample `arr` to `height` x `width` by averaging each block."""
+    sy, sx = -(-arr.shape[0] // height), -(-arr.shape[1] // width)
+    if sy == sx == 1:
+        return arr
+
+    padded = np.zeros((height * sy, width * sx), dtype=np.uint32)
+    padded[: arr.shape[0], : arr.shape[1]] = arr
+    blocks = padded.reshape(height, sy, width, sx).sum(axis=(1, 3))
+    return ((blocks + sy * sx // 2) // (sy * sx)).astype(np.uint16)
+
+
+@dataclass(slots=True)
+class Overlay:
+    """
+    An image to blend over frames. For every pixel format, opacity, and chroma
+    phase it is used with, its planes are converted and premultiplied by alpha
+    once. Blending then only touches the region the image covers, with integer
+    math.
+    """
+
+    image: NDArray[np.uint8]
+    alpha: NDArray[np.uint8] | None
+    layers: dict[tuple, list[tuple[NDArray, NDArray | None]]] = field(
+        default_factory=dict
+    )
+
+    def planes(
+        self, pix_fmt: str, opacity: float, px: int, py: int
+    ) -> list[tuple[NDArray, NDArray | None]]:
+        """
+        Return the image's planes as `pix_fmt`, premultiplied by their weight out
+        of 256, and that weight. The weight is None when the image is opaque.
+
+        The image is padded with transparent pixels: by `px` and `py` so that its
+        chroma samples line up with the frame's, and to even dimensions so that
+        every chroma sample is made from pixels of the image.
+        """
+        key = (pix_fmt, opacity, px, py)
+        if (layers := self.layers.get(key)) is not None:
+            return layers
+
+        height, width = self.image.shape[:2]
+        pad = ((py, (py + height) % 2), (px, (px + width) % 2))
+        image, weight = self.image, None
+        if self.alpha is not None or opacity < 1 or pad != ((0, 0), (0, 0)):
+            alpha = self.alpha
+            if alpha is None:
+                alpha = np.full((height, width), 255, dtype=np.uint8)
+            weight = (alpha * (opacity * 256 / 255) + 0.5).astype(np.uint16)
+            image = np.pad(image, (*pad, (0, 0)), mode="edge")
+            weight = np.pad(weight, pad)
+
+        layers = []
+        converted = av.VideoFrame.from_ndarray(image, format="rgb24")
+        converted = converted.reformat(format=pix_fmt)
+        for plane in converted.planes:
+            arr = plane_array(plane)
+            if weight is None:
+                layers.append((arr.copy(), None))
+                continue
+
+            plane_weight = block_mean(weight, plane.height, plane.width)
+            layers.append((arr * plane_weight, 256 - plane_weight))
+
+        self.layers[key] = layers
+        return layers
+
+    def blend(self, frame: av.VideoFrame, obj: TlImage) -> av.VideoFrame:
+        """Return a copy of a planar YUV `frame` with the image over it."""
+        pix_fmt = frame.format.name
+        result = av.VideoFrame(frame.width, frame.height, pix_fmt)
+
+        chroma = frame.planes[1]
+        cx = round(frame.width / chroma.width)
+        cy = round(frame.height / chroma.height)
+        px, py = obj.x % cx, obj.y % cy
+        layers = self.planes(pix_fmt, obj.opacity, px, py)
+
+        for plane, out_plane, (over, inv_weight) in zip(
+            frame.planes, result.planes, layers
+        ):
+            dst = plane_array(out_plane)
+            dst[:] = plane_array(plane)
+
+            sy = round(frame.height / plane.height)
+            sx = round(frame.width / plane.width)
+            x, y = (obj.x - px) // sx, (obj.y - py) // sy
+            height, width = over.shape
+            x0, y0 = max(x, 0), max(y, 0)
+            x1, y1 = min(x + width, dst.shape[1]), min(y + height, dst.shape[0])
+            if x0 >= x1 or y0 >= y1:
+                continue
+
+            part = (slice(y0 - y, y1 - y), slice(x0 - x, x1 - x))
+            roi = dst[y0:y1, x0:x1]
+            if inv_weight is None:
+                roi[:] = over[part]
+            else:
+                mixed = roi * inv_weight[part]
+                mixed += over[part]
+                mixed += 128
+                mixed >>= 8
+                roi[:] = mixed
+
+        return result
+
+    def blend_rgb(self, frame: av.VideoFrame, obj: TlImage) -> av.VideoFrame:
+        """Blend in RGB, for pixel formats that can't be blended directly."""
+        img = self.image
+        array = frame.to_ndarray(format="rgb24").copy()
+
+        overlay_h, overlay_w, _ = img.shape
+        x_pos, y_pos = obj.x, obj.y
+
+        x_start = max(x_pos, 0)
+        y_start = max(y_pos, 0)
+        x_end = min(x_pos + overlay_w, frame.width)
+        y_end = min(y_pos + overlay_h, frame.height)
+
+        # Clip the overlay image to fit into the frame
+        overlay_x_start = max(-x_pos, 0)
+        overlay_y_start = max(-y_pos, 0)
+        overlay_x_end = overlay_w - max((x_pos + overlay_w) - frame.width, 0)
+        overlay_y_end = overlay_h - max((y_pos + overlay_h) - frame.height, 0)
+        clipped_overlay = img[
+            overlay_y_start:overlay_y_end, overlay_x_start:overlay_x_end
+        ]
+
+        # Create a region of interest (ROI) on the video frame
+        roi = array[y_start:y_end, x_start:x_end]
+
+        # Blend the overlay image with the ROI based on the opacity
+        roi = (1 - obj.opacity) * roi + obj.opacity * clipped_overlay
+        array[y_start:y_end, x_start:x_end] = roi
+        array = np.clip(array, 0, 255).astype(np.uint8)
+
+        return av.VideoFrame.from_ndarray(array, format="rgb24")
+
+    def __call__(self, frame: av.VideoFrame, obj: TlImage) -> av.VideoFrame:
+        if frame.format.name in planar_yuv:
+            return self.blend(frame, obj)
+        return self.blend_rgb(frame, obj)
+
+
+def make_image_cache(tl: v3) -> dict[tuple[FileInfo, int], Overlay]:
     img_cache = {}
     for clip in tl.v:
         for obj in clip:
-            if isinstance(obj, TlImage) and obj.src not in img_cache:
+            if isinstance(obj, TlImage) and (obj.src, obj.width) not in img_cache:
                 with av.open(obj.src.path) as cn:
                     my_stream = cn.streams.video[0]
                     for frame in cn.decode(my_stream):
@@ -77,8 +269,14 @@ def make_image_cache(tl: v3) -> dict[tuple[FileInfo, int], np.ndarray]:
                                 graph.add("buffersink"),
                             ).vpush(frame)
                             frame = graph.vpull()
-                        img_cache[(obj.src, obj.width)] = frame.to_ndarray(
-                            format="rgb24"
+
+                        alpha = None
+                        if any(c.is_alpha for c in frame.format.components):
+                            rgba = frame.to_ndarray(format="rgba")
+                            alpha = rgba[:, :, 3].astype(np.uint8, copy=False)
+                        rgb = frame.to_ndarray(format="rgb24")
+                        img_cache[(obj.src, obj.width)] = Overlay(
+                            rgb.astype(np.uint8, copy=False), alpha
                         )
                         break
     return img_cache
@@ -87,8 +285,6 @@ def make_image_cache(tl: v3) -> dict[tuple[FileInfo, int], np.ndarray]:
 def render_av(
     output: av.container.OutputContainer, tl: v3, args: Args, bar: Bar, log: Log
 ) -> Any:
-    from_ndarray = av.VideoFrame.from_ndarray
-
     src = tl.src
     cns: dict[FileInfo, av.container.InputContainer] = {}
     decoders: dict[FileInfo, Iterator[av.VideoFrame]] = {}
@@ -144,11 +340,26 @@ def render_av(
             target_pix_fmt if target_pix_fmt in allowed_pix_fmt else "yuv420p"
         )
 
-    ops = {"mov_flags": "faststart"}
-    output_stream = output.add_stream(args.video_codec, rate=target_fps, options=ops)
+    smart = None
+    if args.smart_render:
+        smart = make_smart_render(output, tl, args, target_pix_fmt, log)
+
+    if smart is None:
+        ops = {"mov_flags": "faststart"}
+        output_stream = output.add_stream(
+            args.video_codec, rate=target_fps, options=ops
+        )
+    else:
+        output_stream = smart.stream
     yield output_stream
     if not isinstance(output_stream, av.VideoStream):
         log.error(f"Not a known video codec: {args.video_codec}")
+
+    # Smart rendered packets are written as they are, encoded runs use their own
+    # encoder, which is set up from `smart.model`.
+    encoder: av.VideoStream | av.VideoCodecContext = (
+        output_stream if smart is None else smart.model
+    )
     if src.videos and src.videos[0].lang is not None:
         output_stream.metadata["language"] = src.videos[0].lang
 
@@ -167,10 +378,10 @@ def render_av(
             scale_graph.add("buffersink"),
         )
 
-    output_stream.width = target_width
-    output_stream.height = target_height
-    output_stream.pix_fmt = target_pix_fmt
-    output_stream.framerate = target_fps
+    encoder.width = target_width
+    encoder.height = target_height
+    encoder.pix_fmt = target_pix_fmt
+    encoder.framerate = target_fps
 
     color_range = src.videos[0].color_range
     colorspace = src.videos[0].color_space
@@ -178,22 +389,22 @@ def render_av(
     color_trc = src.videos[0].color_transfer
 
     if color_range == 1 or color_range == 2:
-        output_stream.color_range = color_range
+        encoder.color_range = color_range
     if colorspace in (0, 1) or (colorspace >= 3 and colorspace < 16):
-        output_stream.colorspace = colorspace
+        encoder.colorspace = colorspace
     if color_prim == 1 or (color_prim >= 4 and color_prim < 17):
-        output_stream.color_primaries = color_prim
+        encoder.color_primaries = color_prim
     if color_trc == 1 or (color_trc >= 4 and color_trc < 22):
-        output_stream.color_trc = color_trc
+        encoder.color_trc = color_trc
 
     if args.video_bitrate != "auto":
-        output_stream.bit_rate = parse_bitrate(args.video_bitrate, log)
-        log.debug(f"video bitrate: {output_stream.bit_rate}")
+        encoder.bit_rate = parse_bitrate(args.video_bitrate, log)
+        log.debug(f"video bitrate: {encoder.bit_rate}")
     else:
-        log.debug(f"[auto] video bitrate: {output_stream.bit_rate}")
+        log.debug(f"[auto] video bitrate: {encoder.bit_rate}")
 
     if src is not None and src.videos and (sar := src.videos[0].sar) is not None:
-        output_stream.sample_aspect_ratio = sar
+        encoder.sample_aspect_ratio = sar
 
     # First few frames can have an abnormal keyframe count, so never seek there.
     seek = 10
@@ -205,17 +416,29 @@ def render_av(
     bg = args.background
     null_frame = make_solid(target_width, target_height, target_pix_fmt, bg)
     frame_index = -1
+    time_base = 1 / target_fps
+    clips = ClipIndex(tl.v)
+    apply = FilterCache()
+    width, height = tl.res
+    fit = (
+        ("scale", f"{width}:{height}:force_original_aspect_ratio=decrease:eval=frame"),
+        ("pad", f"{width}:{height}:-1:-1:color={bg}"),
+    )
 
     for index in range(tl.end):
+        if smart is not None and (packets := smart.copy(index)) is not None:
+            if index % 3 == 0:
+                bar.tick(index)
+            yield packets
+            continue
+
         obj_list: list[VideoFrame | TlRect | TlImage] = []
-        for layer in tl.v:
-            for lobj in layer:
-                if isinstance(lobj, TlVideo):
-                    if index >= lobj.start and index < (lobj.start + lobj.dur):
-                        _i = round((lobj.offset + index - lobj.start) * lobj.speed)
-                        obj_list.append(VideoFrame(_i, lobj.src))
-                elif index >= lobj.start and index < lobj.start + lobj.dur:
-                    obj_list.append(lobj)
+        for lobj in clips.at(index):
+            if isinstance(lobj, TlVideo):
+                _i = round((lobj.offset + index - lobj.start) * lobj.speed)
+                obj_list.append(VideoFrame(_i, lobj.src))
+            else:
+                obj_list.append(lobj)
 
         if tl.v1 is not None:
             # When there can be valid gaps in the timeline.
@@ -261,60 +484,13 @@ def render_av(
                         log.debug(f"Keyframe {frame_index} {frame.pts}")
 
                 if (frame.width, frame.height) != tl.res:
-                    width, height = tl.res
-                    graph = av.filter.Graph()
-                    graph.link_nodes(
-                        graph.add_buffer(template=my_stream),
-                        graph.add(
-                            "scale",
-                            f"{width}:{height}:force_original_aspect_ratio=decrease:eval=frame",
-                        ),
-                        graph.add("pad", f"{width}:{height}:-1:-1:color={bg}"),
-                        graph.add("buffersink"),
-                    ).vpush(frame)
-                    frame = graph.vpull()
+                    frame = apply(frame, *fit)
             elif isinstance(obj, TlRect):
-                graph = av.filter.Graph()
-                x, y = obj.x, obj.y
-                graph.link_nodes(
-                    graph.add_buffer(template=my_stream),
-                    graph.add(
-                        "drawbox",
-                        f"x={x}:y={y}:w={obj.width}:h={obj.height}:color={obj.fill}:t=fill",
-                    ),
-                    graph.add("buffersink"),
-                ).vpush(frame)
-                frame = graph.vpull()
+                x, y, w, h = obj.x, obj.y, obj.width, obj.height
+                box = f"x={x}:y={y}:w={w}:h={h}:color={obj.fill}:t=fill"
+                frame = apply(frame, ("drawbox", box))
             elif isinstance(obj, TlImage):
-                img = img_cache[(obj.src, obj.width)]
-                array = frame.to_ndarray(format="rgb24")
-
-                overlay_h, overlay_w, _ = img.shape
-                x_pos, y_pos = obj.x, obj.y
-
-                x_start = max(x_pos, 0)
-                y_start = max(y_pos, 0)
-                x_end = min(x_pos + overlay_w, frame.width)
-                y_end = min(y_pos + overlay_h, frame.height)
-
-                # Clip the overlay image to fit into the frame
-                overlay_x_start = max(-x_pos, 0)
-                overlay_y_start = max(-y_pos, 0)
-                overlay_x_end = overlay_w - max((x_pos + overlay_w) - frame.width, 0)
-                overlay_y_end = overlay_h - max((y_pos + overlay_h) - frame.height, 0)
-                clipped_overlay = img[
-                    overlay_y_start:overlay_y_end, overlay_x_start:overlay_x_end
-                ]
-
-                # Create a region of interest (ROI) on the video frame
-                roi = array[y_start:y_end, x_start:x_end]
-
-                # Blend the overlay image with the ROI based on the opacity
-                roi = (1 - obj.opacity) * roi + obj.opacity * clipped_overlay
-                array[y_start:y_end, x_start:x_end] = roi
-                array = np.clip(array, 0, 255).astype(np.uint8)
-
-                frame = from_ndarray(array, format="rgb24")
+                frame = img_cache[(obj.src, obj.width)](frame, obj)
 
         if scale_graph is not None and frame.width != target_width:
             scale_graph.vpush(frame)
@@ -326,7 +502,19 @@ def render_av(
         elif index % 3 == 0:
             bar.tick(index)
 
-        yield from_ndarray(frame.to_ndarray(), format=frame.format.name)
+        # Hand the frame over as is, only replacing the timing and picture type
+        # it was decoded with so the encoder can pick frame types itself.
+        frame.pts = index
+        frame.time_base = time_base
+        frame.pict_type = PictureType.NONE
+        if smart is None:
+            yield frame
+        else:
+            yield smart.encode(frame)
+
+    if smart is not None:
+        yield smart.flush()
+        log.debug(f"Smart render: {smart.copied} copied, {smart.encoded} encoded")
 
     bar.end()
     log.debug(f"Total frames saved seeking: {frames_saved}")
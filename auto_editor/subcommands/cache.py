@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import sys
+from dataclasses import dataclass
+from datetime import datetime
+
+from auto_editor.cache import KEY_MODES, Cache, CacheEntry
+from auto_editor.utils.types import file_size
+from auto_editor.vanparse import ArgumentParser
+
+
+@dataclass(slots=True)
+class CacheArgs:
+    action: str = "list"
+    max_size: int | None = None
+    key_mode: str | None = None
+    help: bool = False
+
+
+def cache_options(parser: ArgumentParser) -> ArgumentParser:
+    parser.add_required(
+        "action",
+        nargs=1,
+        choices=("list", "prune", "clear"),
+        metavar="action [options]",
+    )
+    parser.add_argument(
+        "--max-size",
+        type=file_size,
+        metavar="SIZE",
+        help="Set how large the cache can grow before old entries are removed",
+    )
+    parser.add_argument(
+        "--key-mode",
+        choices=KEY_MODES,
+        metavar="MODE",
+        help="Set how media files are identified in cache keys",
+    )
+    return parser
+
+
+def pretty_size(size: float) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size:.0f} B"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+def print_entries(entries: list[CacheEntry]) -> None:
+    for entry in sorted(entries, key=lambda e: e.used, reverse=True):
+        used = datetime.fromtimestamp(entry.used).strftime("%Y-%m-%d %H:%M")
+        sys.stdout.write(f"{used}  {pretty_size(entry.size):>10}  {entry.key}\n")
+
+
+def main(sys_args: list[str] = sys.argv[1:]) -> None:
+    args = cache_options(ArgumentParser("cache")).parse_args(CacheArgs, sys_args)
+    cache = Cache()
+
+    if args.max_size is not None or args.key_mode is not None:
+        with cache.locked():
+            if args.max_size is not None:
+                cache.max_size = args.max_size
+            if args.key_mode is not None:
+                cache.key_mode = args.key_mode
+            cache.save()
+
+    if args.action == "list":
+        print_entries(list(cache.entries.values()))
+        sys.stdout.write(
+            f"\n{len(cache.entries)} entries, {pretty_size(cache.total_size)} of "
+            f"{pretty_size(cache.max_size)}, keyed by {cache.key_mode}\n"
+            f"{cache.root}\n"
+        )
+    elif args.action == "prune":
+        removed = cache.prune()
+        print_entries(removed)
+        sys.stdout.write(f"Removed {len(removed)} entries\n")
+    elif args.action == "clear":
+        count = len(cache.entries)
+        cache.clear()
+        sys.stdout.write(f"Removed {count} entries\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,9 +7,9 @@ from typing import TYPE_CHECKING
 
 import numpy as np
 
-from auto_editor.analyze import LevelError, Levels, iter_audio, iter_motion
+from auto_editor.analyze import LevelError, Levels, iter_motion
 from auto_editor.ffwrapper import initFileInfo
-from auto_editor.lang.palet import env
+from auto_editor.lang.palet import env, is_feature
 from auto_editor.lib.contracts import is_bool, is_nat, is_nat1, is_str, is_void, orc
 from auto_editor.utils.bar import initBar
 from auto_editor.utils.cmdkw import (
@@ -24,7 +24,7 @@ from auto_editor.utils.types import frame_rate
 from auto_editor.vanparse import ArgumentParser
 
 if TYPE_CHECKING:
-    from collections.abc import Iterator
+    from collections.abc import Iterable
     from fractions import Fraction
 
     from numpy.typing import NDArray
@@ -35,6 +35,7 @@ class LevelArgs:
     input: list[str] = field(default_factory=list)
     edit: str = "audio"
     timebase: Fraction | None = None
+    audio_envelope: bool = False
     help: bool = False
 
 
@@ -52,6 +53,11 @@ def levels_options(parser: ArgumentParser) -> ArgumentParser:
         type=frame_rate,
         help="Set custom timebase",
     )
+    parser.add_argument(
+        "--audio-envelope",
+        flag=True,
+        help="Derive audio levels from a cached 1ms envelope, for any timebase",
+    )
     return parser
 
 
@@ -71,7 +77,7 @@ def print_arr(arr: NDArray) -> None:
     print("")
 
 
-def print_arr_gen(arr: Iterator[float | np.float32]) -> None:
+def print_arr_gen(arr: Iterable[float | np.float32]) -> None:
     print("")
     print("@start")
     for a in arr:
@@ -99,12 +105,22 @@ def main(sys_args: list[str] = sys.argv[1:]) -> None:
     else:
         method, attrs = args.edit, ""
 
-    audio_builder = pAttrs("audio", pAttr("stream", 0, is_nat))
+    audio_builder = pAttrs(
+        "audio", pAttr("stream", 0, is_nat), pAttr("rate", 0, is_nat)
+    )
+    feature_builder = pAttrs(
+        "feature",
+        pAttr("name", Required, is_feature),
+        pAttr("stream", 0, is_nat),
+        pAttr("rate", 0, is_nat),
+    )
     motion_builder = pAttrs(
         "motion",
         pAttr("stream", 0, is_nat),
         pAttr("blur", 9, is_nat),
         pAttr("width", 400, is_nat1),
+        pAttr("stride", 1, is_nat1),
+        pAttr("roi", "", is_str),
     )
     subtitle_builder = pAttrs(
         "subtitle",
@@ -116,6 +132,7 @@ def main(sys_args: list[str] = sys.argv[1:]) -> None:
 
     builder_map = {
         "audio": audio_builder,
+        "feature": feature_builder,
         "motion": motion_builder,
         "subtitle": subtitle_builder,
     }
@@ -127,10 +144,14 @@ def main(sys_args: list[str] = sys.argv[1:]) -> None:
             except ParserError as e:
                 log.error(e)
 
-        levels = Levels(src, tb, bar, False, log, strict=True)
+        levels = Levels(
+            src, tb, bar, False, log, strict=True, envelope=args.audio_envelope
+        )
         try:
             if method == "audio":
-                print_arr_gen(iter_audio(src, tb, **obj))
+                print_arr_gen(levels.audio(**obj))
+            elif method == "feature":
+                print_arr_gen(levels.feature(**obj))
             elif method == "motion":
                 print_arr_gen(iter_motion(src, tb, **obj))
             elif method == "subtitle":
@@ -6,16 +6,36 @@ import subprocess
 import sys
 from dataclasses import dataclass, field
 from fractions import Fraction
+from pathlib import Path
+from tempfile import TemporaryDirectory
 from time import perf_counter
 from typing import TYPE_CHECKING
 
+import av
 import numpy as np
 
+from auto_editor.analyze import (
+    ENVELOPE_TB,
+    FEATURES,
+    AudioFeatures,
+    Levels,
+    MotionAnalyzer,
+    analyze_segment,
+    iter_audio,
+    obj_tag,
+    pool_envelope,
+    wav_peaks,
+)
+from auto_editor.cache import Cache
 from auto_editor.ffwrapper import FileInfo, initFileInfo
 from auto_editor.lang.palet import Lexer, Parser, env, interpret
 from auto_editor.lang.stdenv import make_standard_env
 from auto_editor.lib.data_structs import Char
 from auto_editor.lib.err import MyError
+from auto_editor.render.smart import parameter_sets
+from auto_editor.render.video import Overlay
+from auto_editor.timeline import ClipIndex, TlImage, TlRect
+from auto_editor.utils.bar import initBar
 from auto_editor.utils.log import Log
 from auto_editor.vanparse import ArgumentParser
 
@@ -225,6 +245,104 @@ def main(sys_args: list[str] | None = None):
     def levels():
         run.raw(["levels", "resources/multi-track.mov"])
         run.raw(["levels", "resources/new-commentary.mp3"])
+        run.raw(["levels", "example.mp4", "--edit", 'feature:"rms"'])
+        run.raw(["levels", "example.mp4", "--edit", 'feature:name="low",rate=8000'])
+
+    def wav_fast_path():
+        for name in ("example-cut-s16le.wav", "pcm-f32le.wav", "pcm-s32le.wav"):
+            src = fileinfo(f"resources/wav/{name}")
+            fast = wav_peaks(src.path, Fraction(30))
+            decoded = np.fromiter(iter_audio(src, Fraction(30)), dtype=np.float32)
+            assert fast is not None and np.allclose(fast, decoded, atol=1e-6), name
+
+    def clip_index():
+        rng = np.random.default_rng(0)
+        v = [
+            [
+                TlRect(int(start), int(dur), 0, 0, 2, 2, "#000")
+                for start, dur in rng.integers(0, 200, (50, 2))
+            ]
+            for _ in range(3)
+        ]
+        clips = ClipIndex(v)
+        for index in [*range(250), 10, 150, 149]:
+            active = [
+                o for layer in v for o in layer if o.start <= index < o.start + o.dur
+            ]
+            assert [id(o) for o in clips.at(index)] == [id(o) for o in active], index
+
+    def image_overlay():
+        # Blending in YUV is close to blending in RGB, and leaves the frame alone.
+        y, x = np.mgrid[0:48, 0:64]
+        base = np.stack([x * 4, y * 5, x + y], axis=-1).astype(np.uint8)
+        img = np.stack([255 - x[:21, :31] * 8, y[:21, :31] * 12, x[:21, :31]], -1)
+        overlay = Overlay(img.astype(np.uint8), None)
+        src = fileinfo("resources/testsrc.mp4")
+        for pix_fmt in ("yuv420p", "yuv444p"):
+            frame = av.VideoFrame.from_ndarray(base, format="rgb24")
+            frame = frame.reformat(format=pix_fmt)
+            before = frame.to_ndarray(format="rgb24").copy()
+            for pos in ((10, 5), (-7, -3), (50, 37)):
+                obj = TlImage(0, 1, src, *pos, 0, 0.6)
+                want = overlay.blend_rgb(frame, obj).reformat(format=pix_fmt)
+                got = overlay(frame, obj).to_ndarray(format="rgb24")
+                diff = np.abs(got.astype(int) - want.to_ndarray(format="rgb24"))
+                assert diff.mean() < 2, (pix_fmt, pos, diff.mean())
+            assert np.array_equal(frame.to_ndarray(format="rgb24"), before)
+
+    def audio_envelope():
+        src = fileinfo("resources/wav/example-cut-s16le.wav")
+        env = wav_peaks(src.path, ENVELOPE_TB)
+        assert env is not None
+        assert np.array_equal(pool_envelope(env, ENVELOPE_TB), env)
+        for tb in (Fraction(30), Fraction(30000, 1001), Fraction(24)):
+            exact = wav_peaks(src.path, tb)
+            pooled = pool_envelope(env, tb)
+            assert exact is not None and abs(len(exact) - len(pooled)) <= 1
+            n = min(len(exact), len(pooled))
+            assert np.all(pooled[:n] >= exact[:n])
+
+            # Levels are the exact peaks unless pooling is asked for.
+            bar = initBar("none")
+            levels = Levels(src, tb, bar, True, log, True)
+            assert np.array_equal(levels.audio(0), exact)
+            levels = Levels(src, tb, bar, True, log, True, envelope=True)
+            assert np.array_equal(levels.audio(0), pooled)
+
+    def audio_features():
+        # The peak feature is the same as the audio levels.
+        src = fileinfo("resources/wav/pcm-f32le.wav")
+        levels = Levels(src, Fraction(30), initBar("none"), True, log, True)
+        features = levels.features(0)
+        assert features.shape[1] == 6
+        assert np.allclose(features[:, 0], wav_peaks(src.path, Fraction(30)))
+
+        # A full scale 997Hz sine reads -3.01 LUFS and sits in the speech band.
+        for rate in (48000, 44100):
+            t = np.arange(rate) / rate
+            sine = np.sin(2 * np.pi * 997 * t).astype(np.float32)
+            rows = AudioFeatures(rate, Fraction(30)).push(sine[np.newaxis])
+            row = dict(zip(FEATURES, rows.mean(axis=0)))
+            assert abs(row["loudness"] + 3.01) < 0.05, row
+            assert abs(row["speech"] - np.sqrt(0.5)) < 0.01, row
+            assert row["low"] < 1e-3 and row["high"] < 1e-3, row
+
+    def media_length():
+        # Probing gives the same length as decoding the audio does.
+        paths = ["example.mp4"]
+        for root, _, names in os.walk("resources"):
+            paths += [os.path.join(root, name) for name in names]
+        bar = initBar("none")
+        for path in sorted(paths):
+            if not path.endswith((".mp4", ".mkv", ".mov", ".m4a", ".mp3", ".wav")):
+                continue
+            src = fileinfo(path)
+            if not src.audios:
+                continue
+            for tb in (Fraction(30), Fraction(30000, 1001), Fraction(24)):
+                probed = Levels(src, tb, bar, True, log, True).probe_length()
+                decoded = Levels(src, tb, bar, True, log, True).audio(0)
+                assert probed == len(decoded), (path, tb, probed, len(decoded))
 
     def subdump():
         run.raw(["subdump", "resources/mov_text.mp4"])
@@ -233,6 +351,56 @@ def main(sys_args: list[str] | None = None):
     def desc():
         run.raw(["desc", "example.mp4"])
 
+    def cache():
+        # Point the cache at a temporary directory so the user's is left alone.
+        tmpdir = os.environ.get("TMPDIR")
+        with TemporaryDirectory() as temp:
+            os.environ["TMPDIR"] = temp
+            try:
+                out = run.main(["example.mp4"], ["--edit", "audio"])
+                run.raw(["cache", "list"])
+                run.raw(["cache", "prune", "--max-size", "1GiB"])
+                run.raw(["cache", "clear"])
+                run.raw(["cache", "list", "--key-mode", "content"])
+                run.main(["example.mp4"], ["--edit", "audio"])
+                run.raw(["cache", "list", "--key-mode", "path"])
+            finally:
+                if tmpdir is None:
+                    del os.environ["TMPDIR"]
+                else:
+                    os.environ["TMPDIR"] = tmpdir
+
+        # Entries of different sources and kinds coexist, and going over
+        # `max_size` evicts the least recently used one.
+        keys = [
+            obj_tag(Path("example.mp4"), "audio", Fraction(30), (0, 0)),
+            obj_tag(Path("example.mp4"), "motion", Fraction(30), (0, 400, 9, 1, "")),
+            obj_tag(Path("resources/mono.mp3"), "audio", Fraction(30), (0, 0)),
+            obj_tag(Path("resources/mono.mp3"), "audio", Fraction(24), (0, 0)),
+        ]
+        with TemporaryDirectory() as temp:
+            store = Cache(root=temp)
+            for i, key in enumerate(keys[:3]):
+                store.put(key, np.full(1000, i, dtype=np.float32))
+            for i, key in enumerate(keys[:3]):
+                arr = store.get(key)
+                assert arr is not None and np.all(arr == i)
+
+            # Make the entries old, in order, then use the oldest again.
+            with store.locked():
+                store.max_size = 3 * store.entries[keys[0]].size
+                for i, key in enumerate(keys[:3]):
+                    store.entries[key].used = i
+                store.save()
+            assert store.get(keys[0]) is not None
+            store.put(keys[3], np.full(1000, 3, dtype=np.float32))
+
+            store = Cache(root=temp)
+            assert set(store.entries) == {keys[0], keys[2], keys[3]}
+            assert store.get(keys[1]) is None
+            assert len([f for f in os.listdir(temp) if f.endswith(".npy")]) == 3
+        return out
+
     def example():
         out = run.main(inputs=["example.mp4"], cmd=[])
         cn = fileinfo(out)
@@ -338,6 +506,11 @@ def main(sys_args: list[str] | None = None):
         run.main(["example.mp4"], ["--progress", "none"])
         return run.main(["example.mp4"], ["--progress", "ascii"])
 
+    def preview():
+        run.raw(["example.mp4", "--preview", "--no-cache"])
+        video = "resources/only-video/man-on-green-screen.mp4"
+        run.raw([video, "--edit", "motion", "--preview"])
+
     def silent_threshold():
         return run.main(
             ["resources/new-commentary.mp3"], ["--edit", "audio:threshold=0.1"]
@@ -378,6 +551,11 @@ def main(sys_args: list[str] | None = None):
         assert len(cn.audios) == 1
         assert len(cn.subtitles) == 1
 
+    def subtitle_edit():
+        # Both patterns are matched against one decoded subtitle index.
+        edit = '(or (subtitle "oop") (subtitle "BOOP" #:ignore-case #t #:max-count 1))'
+        return run.main(["resources/webvtt.mkv"], ["--edit", edit])
+
     def resolution_and_scale():
         cn = fileinfo(run.main(["example.mp4"], ["--scale", "1.5"]))
 
@@ -443,6 +621,66 @@ def main(sys_args: list[str] | None = None):
 
         return out
 
+    def analysis_jobs():
+        out = run.main(
+            ["resources/multi-track.mov"],
+            ["--edit", "audio:stream=all", "--analysis-jobs", "2", "--no-cache"],
+        )
+        out2 = run.main(
+            ["resources/only-video/man-on-green-screen.mp4"],
+            ["--edit", "motion", "--analysis-jobs", "2", "--no-cache"],
+        )
+
+        # Short segments are stitched back into the levels of a single pass.
+        src = fileinfo("example.mp4")
+        bar = initBar("none")
+        serial = Levels(src, Fraction(30), bar, True, log, True)
+        split = Levels(src, Fraction(30), bar, True, log, True, jobs=4, min_segment=3)
+        assert len(split.segments(serial.media_length)) == 4
+        for rate in (0, 8000):
+            assert np.array_equal(split.audio(0, rate), serial.audio(0, rate))
+            assert np.array_equal(split.features(0, rate), serial.features(0, rate))
+        for stride in (1, 4):
+            want = serial.motion(0, 9, 400, stride)
+            assert np.array_equal(split.motion(0, 9, 400, stride), want)
+        return out, out2
+
+    def segmented_rate():
+        # Segments that start mid-stream resample to the same samples as one run.
+        src = fileinfo("example.mp4")
+        specs = [("audio", (0, 8000)), ("audio-features", (0, 8000))]
+        for tb in (Fraction(30), Fraction(30000, 1001), Fraction(24)):
+            serial = analyze_segment(src, tb, specs, 0, None)
+            bounds = [0, len(serial[0]) // 3, len(serial[0]) * 2 // 3]
+            ends: list[int | None] = [*bounds[1:], None]
+            parts = [analyze_segment(src, tb, specs, *b) for b in zip(bounds, ends)]
+            for i, arr in enumerate(serial):
+                assert np.array_equal(np.concatenate([p[i] for p in parts]), arr)
+
+    def resume_analysis():
+        # A file that changed without shrinking only has its end analyzed again.
+        shutil.copy("example.mp4", "resume.mp4")
+        src = fileinfo("resume.mp4")
+        bar = initBar("none")
+
+        levels = Levels(src, Fraction(30), bar, False, log, True)
+        audio, motion = levels.audio(0), levels.motion(0, 9, 400)
+        os.utime(src.path, (1, 1))
+
+        levels = Levels(src, Fraction(30), bar, False, log, True)
+        assert np.array_equal(levels.audio(0), audio)
+        assert np.array_equal(levels.motion(0, 9, 400), motion)
+
+        # A file rewritten in place isn't resumed, even when it didn't shrink.
+        analyzer = MotionAnalyzer(Fraction(30), 0, 400, 9)
+        assert levels.resume([analyzer], 1)[0] > 0
+        size = os.path.getsize(src.path)
+        with open(src.path, "r+b") as file:
+            file.seek(size // 3)
+            file.write(bytes(size // 3))
+        assert levels.resume([analyzer], 1) == (0, [])
+        return "resume.mp4"
+
     def concat():
         out = run.main(["example.mp4"], ["--cut-out", "0,171"], "hmm.mp4")
         out2 = run.main(["example.mp4", "hmm.mp4"], ["--debug"])
@@ -521,11 +759,29 @@ def main(sys_args: list[str] | None = None):
             ["resources/only-video/man-on-green-screen.mp4"],
             ["--edit", "motion:threshold=0,width=200"],
         )
-        return out, out2
+        out3 = run.main(
+            ["resources/only-video/man-on-green-screen.mp4"],
+            ["--edit", "motion:stride=3"],
+        )
+        # Served from the grayscale proxy kept by the first run.
+        out4 = run.main(
+            ["resources/only-video/man-on-green-screen.mp4"],
+            ["--edit", "motion:blur=3"],
+        )
+        out5 = run.main(
+            ["resources/only-video/man-on-green-screen.mp4"],
+            ["--edit", 'motion:roi="iw/2:ih:0:0"'],
+        )
+        return out, out2, out3, out4, out5
 
     def edit_positive_tests():
         run.main(["resources/multi-track.mov"], ["--edit", "audio:stream=all"])
         run.main(["resources/multi-track.mov"], ["--edit", "not audio:stream=all"])
+        run.main(["resources/multi-track.mov"], ["--edit", "audio:rate=8000"])
+        run.main(
+            ["resources/multi-track.mov"],
+            ["--edit", '(and (feature "speech" 0.02) (feature "loudness" -35))'],
+        )
         run.main(
             ["resources/multi-track.mov"],
             ["--edit", "(or (not audio:threshold=4%) audio:stream=1)"],
@@ -545,6 +801,19 @@ def main(sys_args: list[str] | None = None):
             ["resources/only-video/man-on-green-screen.gif", "--edit", "audio"],
             "audio stream '0' does not ",
         )
+        run.check(
+            ["example.mp4", "--edit", '(feature "volume")'],
+            "expected feature?",
+        )
+        # Bad arguments are reported by the call, not by analyzing ahead.
+        for edit, match in (
+            ('audio:stream="x"', "expected (or/c nat? 'all)"),
+            ("audio:rate=-5", "expected nat?"),
+            ("motion:stride=0", "expected nat1?"),
+            ("motion:width=0", "expected nat1?"),
+            ('motion:roi="zz"', "invalid roi"),
+        ):
+            run.check(["example.mp4", "--edit", edit], match)
 
     def yuv442p():
         return run.main(["resources/test_yuv422p.mp4"], [])
@@ -556,6 +825,43 @@ def main(sys_args: list[str] | None = None):
 
         return out
 
+    def smart_render():
+        # Copied GOPs and encoded frames add up to the same frames as a full render.
+        outs = [
+            run.main(["example.mp4"], []),
+            run.main(["example.mp4"], ["--smart-render"], "example_smart_ALTERED"),
+        ]
+        counts = []
+        for out in outs:
+            with av.open(out) as cn:
+                counts.append(sum(1 for _ in cn.decode(video=0)))
+        assert counts[0] == counts[1], counts
+        assert fileinfo(outs[1]).videos[0].codec == "h264"
+
+        def nal_units(data: bytes, length_size: int) -> list[bytes]:
+            units, pos = [], 0
+            while pos < len(data):
+                size = int.from_bytes(data[pos : pos + length_size], "big")
+                units.append(data[pos + length_size : pos + length_size + size])
+                pos += length_size + size
+            return units
+
+        # In-band SPS and PPS that aren't in the avcC header need `avc3`.
+        with av.open(outs[1]) as cn:
+            ctx = cn.streams.video[0].codec_context
+            assert ctx.extradata is not None
+            length_size, headers = parameter_sets(ctx.extradata)
+            in_header = set(nal_units(headers, length_size))
+            in_band = {
+                unit
+                for packet in cn.demux(video=0)
+                for unit in nal_units(bytes(packet), length_size)
+                if unit and unit[0] & 0x1F in (7, 8)
+            }
+            assert in_band - in_header and ctx.codec_tag == "avc3", ctx.codec_tag
+
+        return outs
+
     def audio_norm_f():
         return run.main(["example.mp4"], ["--audio-normalize", "#f"])
 
@@ -657,6 +963,22 @@ def main(sys_args: list[str] | None = None):
                 "(margin (bool-array 0 0 1 1 0 0 0) -2 2)",
                 np.array([0, 0, 0, 0, 1, 1, 0], dtype=np.bool_),
             ),
+            (
+                "(minclip (bool-array 1 0 1 1 0 0 0 1 1 1 1 0 0) 2)",
+                np.array([0, 0, 1, 1, 0, 0, 0, 1, 1, 1, 1, 0, 0], dtype=np.bool_),
+            ),
+            (
+                "(mincut (bool-array 1 0 1 1 0 0 0 1 1 1 1 0 0) 2)",
+                np.array([1, 1, 1, 1, 0, 0, 0, 1, 1, 1, 1, 1, 1], dtype=np.bool_),
+            ),
+            (
+                "(maxclip (bool-array 1 0 1 1 0 0 0 1 1 1 1 0 0) 3)",
+                np.array([1, 0, 1, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0], dtype=np.bool_),
+            ),
+            (
+                "(maxcut (bool-array 1 0 1 1 0 0 0 1 1 1 1 0 0) 2)",
+                np.array([1, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0], dtype=np.bool_),
+            ),
             ("(equal? 3 3)", True),
             ("(equal? 3 3.0)", False),
             ('(equal? 16.3 "Editor")', False),
@@ -727,7 +1049,21 @@ def main(sys_args: list[str] | None = None):
         tests.extend([palet_python_bridge, palet_scripts])
 
     if args.category in ("sub", "all"):
-        tests.extend([info, levels, subdump, desc])
+        tests.extend(
+            [
+                info,
+                levels,
+                wav_fast_path,
+                clip_index,
+                image_overlay,
+                audio_envelope,
+                audio_features,
+                media_length,
+                subdump,
+                desc,
+                cache,
+            ]
+        )
 
     if args.category in ("cli", "all"):
         tests.extend(
@@ -744,9 +1080,13 @@ def main(sys_args: list[str] | None = None):
                 high_speed_test,
                 video_speed,
                 multi_track_edit,
+                analysis_jobs,
+                segmented_rate,
+                resume_analysis,
                 concat_mux_tracks,
                 concat_multiple_tracks,
                 frame_rate,
+                smart_render,
                 help_tests,
                 version_test,
                 parser_test,
@@ -761,11 +1101,13 @@ def main(sys_args: list[str] | None = None):
                 input_extension,
                 output_extension,
                 progress,
+                preview,
                 silent_threshold,
                 track_tests,
                 codec_tests,
                 premiere_named_export,
                 export_subtitles,
+                subtitle_edit,
                 export,
                 motion,
                 resolution_and_scale,
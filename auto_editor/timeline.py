@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
+from heapq import heappop, heappush
 from typing import TYPE_CHECKING
 
 from auto_editor.ffwrapper import initFileInfo, mux
@@ -9,7 +10,7 @@ from auto_editor.utils.cmdkw import Required, pAttr, pAttrs
 from auto_editor.utils.types import natural, number, parse_color, threshold
 
 if TYPE_CHECKING:
-    from collections.abc import Iterator
+    from collections.abc import Iterator, Sequence
     from fractions import Fraction
     from pathlib import Path
     from typing import Any
@@ -180,6 +181,58 @@ ALayer = list[TlAudio]
 ASpace = list[ALayer]
 
 
+class ClipIndex:
+    """
+    Find the objects of a `VSpace` or `ASpace` that are active at a tick, in the
+    order they are layered. Asking for ticks in increasing order is a sweep line:
+    every object is added and removed once, so each tick is amortized constant
+    time. Asking for an earlier tick restarts the sweep.
+    """
+
+    __slots__ = ("objs", "cursor", "ends", "active", "current", "tick")
+
+    def __init__(self, space: Sequence[Sequence[Any]]) -> None:
+        self.objs = sorted(
+            (
+                (obj.start, (i, j), obj)
+                for i, layer in enumerate(space)
+                for j, obj in enumerate(layer)
+                if obj.dur > 0
+            ),
+            key=lambda item: item[0],
+        )
+        self.reset()
+
+    def reset(self) -> None:
+        self.cursor = 0
+        self.ends: list[tuple[int, tuple[int, int]]] = []
+        self.active: dict[tuple[int, int], Any] = {}
+        self.current: list[Any] = []
+        self.tick = -1
+
+    def at(self, tick: int) -> list[Any]:
+        if tick < self.tick:
+            self.reset()
+        self.tick = tick
+
+        changed = False
+        while self.ends and self.ends[0][0] <= tick:
+            del self.active[heappop(self.ends)[1]]
+            changed = True
+
+        while self.cursor < len(self.objs) and self.objs[self.cursor][0] <= tick:
+            _, key, obj = self.objs[self.cursor]
+            self.cursor += 1
+            if obj.start + obj.dur > tick:
+                self.active[key] = obj
+                heappush(self.ends, (obj.start + obj.dur, key))
+                changed = True
+
+        if changed:
+            self.current = [self.active[key] for key in sorted(self.active)]
+        return self.current
+
+
 @dataclass
 class v3:
     src: FileInfo | None  # Used as a template for timeline settings
@@ -53,32 +53,47 @@ def to_timecode(secs: float | Fraction, fmt: str) -> str:
     raise ValueError("to_timecode: Unreachable")
 
 
+def run_lengths(arr: NDArray) -> tuple[NDArray[np.intp], NDArray[np.intp]]:
+    """
+    Run-length encode `arr`. Returns the start index and the length of every run
+    of equal values, the value of each run is `arr[starts]`.
+    """
+    if len(arr) == 0:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(arr)) + 1))
+    lengths = np.diff(np.append(starts, len(arr)))
+    return starts, lengths
+
+
+def span_mask(length: int, starts: NDArray, ends: NDArray) -> BoolList:
+    """Return a mask that is true inside every `[start, end)` span."""
+    delta = np.bincount(starts, minlength=length + 1)
+    delta -= np.bincount(ends, minlength=length + 1)
+    return np.cumsum(delta[:length]) > 0
+
+
 def mut_margin(arr: BoolList, start_m: int, end_m: int) -> None:
     # Find start and end indexes
-    start_index = []
-    end_index = []
+    edges = run_lengths(arr)[0][1:]
+    start_index = edges[arr[edges]]
+    end_index = edges[~arr[edges]]
     arrlen = len(arr)
-    for j in range(1, arrlen):
-        if arr[j] != arr[j - 1]:
-            if arr[j]:
-                start_index.append(j)
-            else:
-                end_index.append(j)
 
     # Apply margin
     if start_m > 0:
-        for i in start_index:
-            arr[max(i - start_m, 0) : i] = True
+        lower = np.maximum(start_index - start_m, 0)
+        arr[span_mask(arrlen, lower, start_index)] = True
     if start_m < 0:
-        for i in start_index:
-            arr[i : min(i - start_m, arrlen)] = False
+        upper = np.minimum(start_index - start_m, arrlen)
+        arr[span_mask(arrlen, start_index, upper)] = False
 
     if end_m > 0:
-        for i in end_index:
-            arr[i : min(i + end_m, arrlen)] = True
+        upper = np.minimum(end_index + end_m, arrlen)
+        arr[span_mask(arrlen, end_index, upper)] = True
     if end_m < 0:
-        for i in end_index:
-            arr[max(i + end_m, 0) : i] = False
+        lower = np.maximum(end_index + end_m, 0)
+        arr[span_mask(arrlen, lower, end_index)] = False
 
 
 def get_stdout(cmd: list[str]) -> str:
@@ -110,6 +110,15 @@ def sample_rate(val: str) -> int:
     return natural(num)
 
 
+def file_size(val: str) -> int:
+    num, unit = _split_num_str(val)
+    powers = {"": 0, "B": 0, "K": 1, "M": 2, "G": 3, "T": 4}
+    prefix = unit.upper().removesuffix("IB").removesuffix("B")
+    if prefix not in powers:
+        raise CoerceError(f"'{val}': File size got unknown unit: `{unit}`")
+    return natural(num * 1024 ** powers[prefix])
+
+
 def time(val: str, tb: Fraction) -> int:
     if ":" in val:
         boxes = val.split(":")
@@ -203,6 +212,7 @@ class Args:
     sn: bool = False
     dn: bool = False
     no_seek: bool = False
+    smart_render: bool = False
     cut_out: list[tuple[str, str]] = field(default_factory=list)
     add_in: list[tuple[str, str]] = field(default_factory=list)
     set_speed_for_range: list[tuple[float, str, str]] = field(default_factory=list)
@@ -226,6 +236,8 @@ class Args:
     quiet: bool = False
     preview: bool = False
     no_cache: bool = False
+    analysis_jobs: int = 1
+    audio_envelope: bool = False
     margin: tuple[str, str] = ("0.2s", "0.2s")
     silent_speed: float = 99999.0
     video_speed: float = 1.0